@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# Standalone fan and power button daemon, keeps running while Kodi is down:
+#   python3 daemon.py [config.ini]
+#   python3 daemon.py replay <CSV file or Kodi log>
+#
+import os
+import signal
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from resources.lib import argonheadless
+
+
+def stop(signum, frame):
+    argonheadless.argonheadless_state["abort"].set()
+    argon.request_stop()
+
+
+if len(sys.argv) > 2 and sys.argv[1] == 'replay':
+    argonheadless.argonheadless_start(argonheadless.ARGONHEADLESS_CONFIG)
+    from resources.lib import argon
+    print(argon.replay(sys.argv[2]))
+else:
+    argonheadless.argonheadless_start(sys.argv[1] if len(sys.argv) > 1 else argonheadless.ARGONHEADLESS_CONFIG)
+    from resources.lib import argon
+    from resources.lib import service
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, lambda signum, frame: argonheadless.argonheadless_reload())
+    service.run(headless=True)
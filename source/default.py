@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
+import sys
+
 from resources.lib import kodiutils
 
 
-kodiutils.show_settings()
+if len(sys.argv) > 2 and sys.argv[1] == 'replay':
+    # RunScript(service.argononecontrol,replay,<CSV file or Kodi log>)
+    from resources.lib import argon
+    kodiutils.show_text('Argon ONE Control', argon.replay(sys.argv[2]))
+else:
+    kodiutils.show_settings()
@@ -17,14 +17,21 @@
 #  * recalbox: Runs as service via /etc/init.d/
 #
 
+import concurrent.futures
+import functools
 import importlib.util
+import json
 import os
+import selectors
 import sys
-from shutil import copyfile
-from threading import Event
+from shutil import copyfile, copymode
+from threading import Event, Lock, Thread
 import time
 import zlib
 
+# Reference point of the startup timing instrumentation
+startup_time = time.monotonic()
+
 # For LibreELEC/Lakka, note that we need to add system paths
 sys.path.append('/storage/.kodi/addons/virtual.rpi-tools/lib')
 sys.path.append('/storage/.kodi/addons/virtual.system-tools/lib')
@@ -44,37 +51,192 @@ elif lgpio_spec is not None:
 else:
     from gpiozero import Button
 
-import xbmc
-import xbmcaddon
-
+try:
+    import xbmc
+    import xbmcaddon
+    import xbmcgui
+except ImportError:
+    # Standalone daemon without Kodi, see daemon.py
+    from resources.lib.argonheadless import xbmc, xbmcaddon
+    xbmcgui = None
+
+from resources.lib.argonbutton import *
+from resources.lib.argoncalibrate import *
+from resources.lib.argonpush import *
 from resources.lib.argonregister import *
+from resources.lib.argonreplay import *
 from resources.lib.argonsysinfo import *
+from resources.lib.argonthermal import *
 
 SHUTDOWN_PIN = 4
-
-# Initialize I2C Bus
-bus = argonregister_initializebusobj()
+# Size, mtime and hash of the files managed by the add-on
+MANIFEST_FILE = '/storage/.kodi/userdata/addon_data/service.argononecontrol/provisioning.json'
+# Maximum time in seconds to wait for the sensor reads of one loop iteration
+SENSOR_DEADLINE = 2
+# Seconds a lower fan speed is delayed, to prevent unnecessary fluctuations
+LOWERING_DELAY = 30
+# Number of additional thermal zone/hwmon sensors with their own fan curve
+EXTRA_SENSOR_SLOTS = 3
+# Number of additional fan controllers, e.g. a Fan HAT or a case fan on another bus or address
+FAN_CONTROLLER_SLOTS = 2
+# Number of temperatures pushed by other processes with their own fan curve
+PUSH_SENSOR_SLOTS = 2
+# Sample interval in seconds of the emergency thermal watchdog
+WATCHDOG_INTERVAL = 0.5
+# The RPi firmware starts to throttle the CPU at 80°C, the fan is boosted within the margin below
+THROTTLE_TEMP = 80
+THROTTLE_MARGIN = 5
+THROTTLE_BOOST_SPEED = 100
+# Polling interval in seconds of temp_check while thermal notifications cover the CPU curve
+EVENT_POLL_INTERVAL = 120
+# Maximum time in seconds the service core waits before checking for the Kodi abort
+CORE_MAX_WAIT = 1
+# Polling interval in seconds of temp_check while the playback profiles are on and nothing plays
+IDLE_POLL_INTERVAL = 60
+# Adaptive polling: seconds added per °C distance to the nearest threshold, interval reduction at full CPU load
+POLL_DISTANCE_FACTOR = 15
+POLL_LOAD_FACTOR = 0.3
+# Seconds over which the CPU load of the feed-forward is averaged
+LOAD_WINDOW = 5
+# Videos which select the heavy decode fan curve, as reported by the VideoPlayer info labels
+HEAVY_RESOLUTIONS = ['4k', '8k']
+HEAVY_CODECS = ['hevc', 'h265', 'vp9', 'av1']
+# System status for skins and scripts: refresh interval in seconds, storage and network
+# refresh interval, home window property prefix and the JSON file on tmpfs
+STATUS_INTERVAL = 5
+STATUS_SLOW_INTERVAL = 60
+STATUS_PROPERTY_PREFIX = 'ArgonONE.'
+STATUS_FILE = '/run/argononecontrol.json'
+
+# I2C Bus, initialized by startup()
+bus = None
+bus_lock = Lock()
+# Command set of the Argon ONE, detected when fan_control starts. Until then the thermal
+# watchdog writes with the legacy command set, which every firmware revision understands
+argonregsupport = False
+# Open I2C buses by bus number and the locks which order the writes per bus
+i2c_buses = {}
+i2c_locks = {}
+# Additional fan controllers of the settings, see load_config
+fan_controllers = []
 fansettingupdate = False
-power_btn_triggered = False
+fan_wakeup = Event()
+emergency_fan = Event()
+emergency_temp = 0
+emergency_hysteresis = 5
+throttle_boost = False
+thermal_events_enabled = False
+thermal_event_active = Event()
+# Thresholds of the CPU fan curve and of the throttle boost, watched by the thermal notifications
+cpu_thresholds = []
+# Firmware throttling state, polled with the thermal notifications while throttle_boost is on
+event_throttled = False
+# Pushed temperatures: fan curve by name while the push socket is enabled, (temperature, expiry) by name
+push_curves = {}
+push_readings = {}
+push_lock = Lock()
+# System status publishing and the last samples of the fan control
+status_enabled = False
+status_samples = {"temps": {}, "fanspeed": None}
+status_lock = Lock()
 power_button_mon = Event()
 powerbutton_remap = False
-pulse_signal = False
+# Power button gesture decoder, fed by the edge callbacks
+button_state = argonbutton_newstate()
+button_lock = Lock()
+button_wakeup = Event()
+# Kodi builtin of each gesture
+gesture_actions = {}
+# Fan profile of the current playback: idle, playback or heavy
+playback_profile = 'idle'
+playback_curves = {}
+# Minimum and maximum interval of the adaptive polling, empty if off
+poll_bounds = []
+# Fan calibration requested by the settings, target maximum CPU temperature in °C
+calibration_requested = False
+calibration_target = 70
+# CPU load feed-forward: load threshold (0 if off), minimum fan speed, sampler state
+load_threshold = 0
+load_fanspeed = 0
+load_state = {}
+load_high = False
+# Fan curve of the shadow policy, which replaces the curve of shadow_sensor,
+# only evaluated and logged, empty if off
+shadow_curve = []
+shadow_sensor = 'CPU'
 addon_count = 0
+provision_manifest = None
+stop_pipe = None
+# Wakes up the service core on settings changes, while it runs
+core_pipe = None
+core_lock = Lock()
 
 class SettingMonitor(xbmc.Monitor):
     """Detect Settings Change"""
     def onSettingsChanged(self):
         global fansettingupdate
         fansettingupdate = True
+        core_wakeup()
+
+
+class PlaybackMonitor(xbmc.Player):
+    """Select the fan profile of the playback"""
+    def __init__(self):
+        xbmc.Player.__init__(self)
+        if self.isPlayingVideo():
+            self.onAVStarted()
+
+    def onAVStarted(self):
+        if not self.isPlayingVideo():
+            set_playback_profile('idle')
+            return
+        resolution = xbmc.getInfoLabel('VideoPlayer.VideoResolution').lower()
+        codec = xbmc.getInfoLabel('VideoPlayer.VideoCodec').lower()
+        xbmc.log(msg='Argon ONE Control: video playback started : ' + resolution + ' ' + codec, level=xbmc.LOGDEBUG)
+        if resolution in HEAVY_RESOLUTIONS or codec in HEAVY_CODECS:
+            set_playback_profile('heavy')
+        else:
+            set_playback_profile('playback')
+
+    def onPlayBackStopped(self):
+        set_playback_profile('idle')
+
+    def onPlayBackEnded(self):
+        set_playback_profile('idle')
+
+    def onPlayBackError(self):
+        set_playback_profile('idle')
+
+
+def set_playback_profile(profile):
+    """Switch the fan profile and let temp_check apply it right away"""
+    global playback_profile
+    if profile == playback_profile:
+        return
+    xbmc.log(msg='Argon ONE Control: fan profile : ' + profile, level=xbmc.LOGDEBUG)
+    playback_profile = profile
+    fan_wakeup.set()
+    core_wakeup()
+
+
+def core_wakeup():
+    """Wake up the service core loop, if it runs. The pipe isn't closed while written to"""
+    with core_lock:
+        if core_pipe is not None:
+            try:
+                os.write(core_pipe[1], b'\0')
+            except OSError:
+                # Full, the loop is woken up anyway
+                pass
 
 
 def thread_sleep(sleep_sec, abort_flag):
     """quick interruptible sleep"""
     global fansettingupdate
     for i in range(sleep_sec):
-        if abort_flag.is_set() or fansettingupdate:
+        if abort_flag.is_set() or fansettingupdate or fan_wakeup.is_set():
             break
-        time.sleep(1)
+        fan_wakeup.wait(1)
 
 
 if gpiod_spec is not None:
@@ -87,11 +249,21 @@ if gpiod_spec is not None:
         return "Unknown"
 
 
-    def async_watch_line_value(chip_path, line_offset, done_fd):
-        """Observe the pin edges"""
+    def get_gpiochip():
+        """Path of the gpio chip with the shutdown pin"""
+        if gpiod.is_gpiochip_device('/dev/gpiochip4'):
+            # temporary RPi5 gpiochip assignment up to kernel 6.6.45
+            # https://github.com/raspberrypi/linux/pull/6144
+            return '/dev/gpiochip4'
+        # common
+        return '/dev/gpiochip0'
+
+
+    def request_line(chip_path, line_offset):
+        """Request the edge events of the pin"""
         # Assume a button connecting the pin to ground,
         # so pull it up and provide some debounce.
-        with gpiod.request_lines(
+        return gpiod.request_lines(
             chip_path,
             consumer="Argon ONE Control: async-watch-line-value",
             config={
@@ -101,14 +273,17 @@ if gpiod_spec is not None:
                     bias=Bias.PULL_DOWN,
                 )
             },
-        ) as request:
+        )
+
+
+    def async_watch_line_value(chip_path, line_offset, done_fd):
+        """Observe the pin edges"""
+        with request_line(chip_path, line_offset) as request:
             poll = select.poll()
             poll.register(request.fd, select.POLLIN)
             # Other fds could be registered with the poll and be handled
             # separately using the return value (fd, event) from poll():
             poll.register(done_fd, select.POLLIN)
-            global power_btn_triggered
-            global pulse_signal
             while True:
                 for fd, _event in poll.poll():
                     if fd == done_fd:
@@ -116,11 +291,7 @@ if gpiod_spec is not None:
                         return
                     # handle any edge events
                     for event in request.read_edge_events():
-                        if event.event_type is event.Type.RISING_EDGE:
-                            power_btn_triggered = True
-                            pulse_signal = True
-                        if event.event_type is event.Type.FALLING_EDGE:
-                            pulse_signal = False
+                        power_btn_edge(event.event_type is event.Type.RISING_EDGE, event.timestamp_ns)
                         xbmc.log(
                             msg='Argon ONE Control: offset: {}  type: {:<7}  event #{}'.format(
                                 event.line_offset, edge_type_str(event), event.line_seqno
@@ -129,16 +300,38 @@ if gpiod_spec is not None:
 
 
 def power_btn_pressed(chip=None, gpio=None, level=None, timestamp=None):
-    global power_btn_triggered
-    power_btn_triggered = True
-    if timestamp is not None:
-        xbmc.log(msg='Argon ONE Control: power button pressed event -> {}, {}, {}, {}'.format(chip, gpio, level, timestamp), level=xbmc.LOGDEBUG)
+    if level == 2:
+        # lgpio watchdog timeout, not an edge
+        return
+    if timestamp is None:
+        power_btn_edge(level != 0, time.monotonic_ns())
+        return
+    xbmc.log(msg='Argon ONE Control: power button edge event -> {}, {}, {}, {}'.format(chip, gpio, level, timestamp), level=xbmc.LOGDEBUG)
+    # lgpio stamps the edge in nanoseconds since the epoch, moved to the monotonic clock
+    # of the decoder without the delay until this callback runs
+    power_btn_edge(level != 0, time.monotonic_ns() - max(0, time.time_ns() - timestamp))
+
+
+def power_btn_released():
+    power_btn_edge(False, time.monotonic_ns())
+
+
+def power_btn_edge(rising, timestamp_ns):
+    """Feed an edge of the shutdown pin to the gesture decoder, a decoded gesture is run right away"""
+    if not power_button_mon.is_set():
+        return
+    with button_lock:
+        gesture = argonbutton_edge(button_state, rising, timestamp_ns)
+    button_wakeup.set()
+    if gesture is not None:
+        power_btn_gesture(gesture)
 
 
 def shutdown_check(abort_flag, power_button):
     """
     This function is the thread that monitors activity in our shutdown pin.
-    The pulse width is measured, and the corresponding shell command will be issued.
+    The edges are fed to the gesture decoder by the gpiod/lgpio/gpiozero callbacks,
+    this thread completes the tap gestures after the gap to a further tap has passed.
     """
     global lgpio_spec
     global power_button_mon
@@ -148,20 +341,12 @@ def shutdown_check(abort_flag, power_button):
         xbmc.log(msg='Argon ONE Control: power button monitoring was not running', level=xbmc.LOGDEBUG)
         return
 
-    global power_btn_triggered
-    power_btn_triggered = False
     if gpiod_spec is not None:
         xbmc.log(msg='Argon ONE Control: power button monitoring via gpiod', level=xbmc.LOGDEBUG)
         #Initialize GPIO
         # open the gpio chip and set the pin 4 as input (pull down)
-        if gpiod.is_gpiochip_device('/dev/gpiochip4'):
-            # temporary RPi5 gpiochip assignment up to kernel 6.6.45
-            # https://github.com/raspberrypi/linux/pull/6144
-            gpiochip = '/dev/gpiochip4'
-        else:
-            # common
-            gpiochip = '/dev/gpiochip0'
-        
+        gpiochip = get_gpiochip()
+
         # run the async executor (select.poll) in a thread to demonstrate a graceful exit.
         done_fd = os.eventfd(0)
 
@@ -189,73 +374,39 @@ def shutdown_check(abort_flag, power_button):
             h = lgpio.gpiochip_open(0)
         lgpio.exceptions = True
         #lgpio.gpio_claim_input(h, SHUTDOWN_PIN, lFlags=lgpio.SET_PULL_DOWN)
-        err = lgpio.gpio_claim_alert(h, SHUTDOWN_PIN, eFlags=lgpio.RISING_EDGE, lFlags=lgpio.SET_PULL_DOWN)
+        err = lgpio.gpio_claim_alert(h, SHUTDOWN_PIN, eFlags=lgpio.BOTH_EDGES, lFlags=lgpio.SET_PULL_DOWN)
         if err < 0:
             xbmc.log(msg="GPIO in use {}:{} ({})".format(chip, SHUTDOWN_PIN, lgpio.error_text(err)), level=xbmc.LOGDEBUG)
-        cb_power_btn = lgpio.callback(h, SHUTDOWN_PIN, edge=lgpio.RISING_EDGE, func=power_btn_pressed)
+        cb_power_btn = lgpio.callback(h, SHUTDOWN_PIN, edge=lgpio.BOTH_EDGES, func=power_btn_pressed)
     else:
         xbmc.log(msg='Argon ONE Control: power button monitoring via gpiozero', level=xbmc.LOGDEBUG)
         # pull down the pin
         btn = Button(SHUTDOWN_PIN, pull_up=False)
         btn.when_pressed = power_btn_pressed
+        btn.when_released = power_btn_released
 
     while True:
         if not power_button_mon.is_set():
             xbmc.log(msg='Argon ONE Control: power button monitoring has been disabled', level=xbmc.LOGDEBUG)
         power_button_mon.wait()
         if abort_flag.is_set():
+            xbmc.log(msg='Argon ONE Control: button monitoring loop aborted', level=xbmc.LOGDEBUG)
             break
-        pulsetime = 1
-        time.sleep(0.001)
-        if power_btn_triggered:
-            power_btn_triggered = False
-            xbmc.log(msg='Argon ONE Control: power button was pressed', level=xbmc.LOGDEBUG)
-            time.sleep(0.01)
-            # wait until the button is released
-            if gpiod_spec is not None:
-                # gpiod in use
-                while pulse_signal:
-                    time.sleep(0.01)
-                    pulsetime += 1
-                    if abort_flag.is_set() or not power_button_mon.is_set():
-                        xbmc.log(msg='Argon ONE Control: button monitoring loop 2 aborted', level=xbmc.LOGDEBUG)
-                        break
-            elif lgpio_spec is not None:
-                # lgpio in use
-                while lgpio.gpio_read(h, SHUTDOWN_PIN) == 1:
-                    time.sleep(0.01)
-                    pulsetime += 1
-                    if abort_flag.is_set() or not power_button_mon.is_set():
-                        xbmc.log(msg='Argon ONE Control: button monitoring loop 2 aborted', level=xbmc.LOGDEBUG)
-                        break
-            else:
-                # gpiozero in use
-                while btn.is_pressed:
-                    time.sleep(0.01)
-                    pulsetime += 1
-                    if abort_flag.is_set() or not power_button_mon.is_set():
-                        xbmc.log(msg='Argon ONE Control: button monitoring loop 2 aborted', level=xbmc.LOGDEBUG)
-                        break
-
-            xbmc.log(msg='Argon ONE Control: power button was released', level=xbmc.LOGDEBUG)
-            if pulsetime >= 2 and pulsetime <= 3:
-                if powerbutton_remap:
-                    xbmc.shutdown()
-                else:
-                    xbmc.restart()
-            elif pulsetime >= 4 and pulsetime <= 5:
-                xbmc.shutdown()
-        if abort_flag.is_set():
-            xbmc.log(msg='Argon ONE Control: button monitoring loop 1 aborted', level=xbmc.LOGDEBUG)
-            break
+        # The edges are decoded right away, only pending taps wait for the gap to pass
+        with button_lock:
+            timeout = argonbutton_timeout(button_state, time.monotonic_ns())
+        button_wakeup.wait(1 if timeout is None else timeout)
+        button_wakeup.clear()
+        with button_lock:
+            gesture = argonbutton_expire(button_state, time.monotonic_ns())
+        if gesture is not None:
+            power_btn_gesture(gesture)
     # freeing the GPIO resources
     if gpiod_spec is not None:
         # gpiod in use
         # stop background thread
-        t.join(0.2)
-        if t.is_alive():
-            os.eventfd_write(done_fd, 1)
-            t.join()
+        os.eventfd_write(done_fd, 1)
+        t.join()
         os.close(done_fd)
     elif lgpio_spec is not None:
         # lgpio in use
@@ -275,6 +426,16 @@ def shutdown_check(abort_flag, power_button):
     xbmc.log(msg='Argon ONE Control: power button monitoring stopped', level=xbmc.LOGDEBUG)
 
 
+def power_btn_gesture(gesture):
+    """Run the Kodi builtin configured for the gesture, nothing if empty"""
+    action = gesture_actions.get(gesture, '')
+    if gesture == 'double' and powerbutton_remap:
+        action = 'ShutDown'
+    xbmc.log(msg='Argon ONE Control: power button gesture ' + gesture + ' : ' + action, level=xbmc.LOGDEBUG)
+    if action:
+        xbmc.executebuiltin(action)
+
+
 def get_fanspeed(tempval, configlist):
     """
     This function converts the corresponding fanspeed for the given temperature
@@ -293,6 +454,286 @@ def get_fanspeed(tempval, configlist):
     return 0
 
 
+def get_sensor_reader(name):
+    """Return the read function of a sensor name, additional sensors by thermal zone or hwmon name"""
+    readers = {'CPU': argonsysinfo_getcputemp, 'GPU': argonsysinfo_getgputemp, 'SSD/NVMe': argonsysinfo_getmaxhddtemp, 'PMIC': argonsysinfo_getpmictemp}
+    if name in readers:
+        return readers[name]
+    return functools.partial(argonsysinfo_getsensortemp, name)
+
+
+def get_i2c_bus(busnum):
+    """Return the I2C bus and its lock, the bus is opened once and stays open"""
+    if busnum not in i2c_locks:
+        i2c_locks[busnum] = Lock()
+    if i2c_buses.get(busnum) is None:
+        i2c_buses[busnum] = argonregister_initializebusobj(busnum)
+    return i2c_buses[busnum], i2c_locks[busnum]
+
+
+def set_controller_speeds(controllers, speeds):
+    """
+    This function writes the changed fan speeds to the additional fan controllers. The writes are
+    grouped by I2C bus, in the order of the controllers. Each write holds the lock of its bus, so
+    the writes to one bus never overlap with the other threads, i.e. the thermal watchdog.
+    A failed write is retried with the next call.
+    """
+    buses = []
+    for controller in controllers:
+        if controller['bus'] not in buses:
+            buses.append(controller['bus'])
+    for busnum in buses:
+        for idx in range(len(controllers)):
+            controller = controllers[idx]
+            if controller['bus'] != busnum or speeds[idx] == controller['speed'] or controller['busobj'] is None:
+                continue
+            try:
+                with controller['lock']:
+                    if emergency_fan.is_set() and speeds[idx] < 100:
+                        continue
+                    argonregister_setfanspeed(controller['busobj'], speeds[idx], controller['regsupport'], controller['address'])
+                controller['speed'] = speeds[idx]
+                xbmc.log(msg='Argon ONE Control: ' + controller['name'] + ' fan speed set to ' + str(speeds[idx]), level=xbmc.LOGDEBUG)
+            except IOError:
+                xbmc.log(msg='Argon ONE Control: ' + controller['name'] + ' fan speed not set', level=xbmc.LOGDEBUG)
+
+
+def set_fanspeed(newspeed):
+    """Write the Argon ONE fan speed, unless the thermal watchdog runs the fan, True if written"""
+    with bus_lock:
+        if emergency_fan.is_set():
+            return False
+        argonregister_setfanspeed(bus, newspeed, argonregsupport)
+    return True
+
+
+def check_cmdset(busobj, lock, devaddr=ADDR_ARGONONEREG):
+    """Detect the command set of a fan controller, holding the lock of its bus"""
+    with lock:
+        return argonregister_checksupport(busobj, devaddr)
+
+
+def fan_io(i2c_executor, func, *args):
+    """
+    This function runs an I2C access of fan_control or fan_calibration including its settle delay,
+    to be called with yield from. With i2c_executor the access runs there, and the list with its
+    future is yielded like the sensor reads until it is done, so the caller's loop isn't blocked.
+    Returns the result of func, its exception is raised again.
+    """
+    if i2c_executor is None:
+        return func(*args)
+    future = i2c_executor.submit(func, *args)
+    while not future.done():
+        yield [future]
+    return future.result()
+
+
+def parse_curve(curvestr, temperature_unit):
+    """
+    This function converts a fan curve given as "<temperature>=<speed>, ..." into the
+    configuration list used by get_fanspeed. Invalid pairs are ignored.
+    """
+    newconfig = []
+    for curpair in curvestr.split(','):
+        curpair = curpair.split('=')
+        if len(curpair) != 2:
+            continue
+        try:
+            tempval = float(curpair[0])
+            fanval = int(float(curpair[1]))
+        except ValueError:
+            continue
+        if temperature_unit == '°F':
+            tempval = (tempval-32.0) * 5.0/9.0
+        newconfig.append( "{:5.1f}={}".format(tempval,fanval))
+    newconfig.sort(reverse=True)
+    return newconfig
+
+
+def get_throttle_fanspeed(cputemp, throttle_state):
+    """
+    This function returns the fan speed to prevent or counter CPU throttling.
+    The fan is boosted if the firmware reports an active frequency cap, throttling or soft
+    temperature limit, or pre-emptively if the CPU runs at full clock close to THROTTLE_TEMP.
+    A pre-emptive boost that ends without any throttling in between is logged as prevented.
+    The throttle_state dict keeps the boost state between the calls.
+    """
+    throttled = argonsysinfo_getthrottled()
+    if throttled > 0 and throttled & 0xE:
+        if not throttle_state.get('throttled', False):
+            xbmc.log(msg='Argon ONE Control: CPU throttling active : ' + hex(throttled), level=xbmc.LOGINFO)
+        throttle_state['throttled'] = True
+        throttle_state['boost'] = True
+        return THROTTLE_BOOST_SPEED
+    if throttle_state.get('throttled', False):
+        xbmc.log(msg='Argon ONE Control: CPU throttling ended', level=xbmc.LOGINFO)
+        throttle_state['throttled'] = False
+        throttle_state['boost'] = False
+
+    if cputemp >= THROTTLE_TEMP - THROTTLE_MARGIN and argonsysinfo_getcpufreqratio() >= 0.95:
+        if not throttle_state.get('boost', False):
+            xbmc.log(msg='Argon ONE Control: CPU at full clock and ' + str(cputemp) + ', fan boosted to prevent throttling', level=xbmc.LOGDEBUG)
+            throttle_state['boost'] = True
+        return THROTTLE_BOOST_SPEED
+    if throttle_state.get('boost', False):
+        throttle_state['boost'] = False
+        throttle_state['prevented'] = throttle_state.get('prevented', 0) + 1
+        xbmc.log(msg='Argon ONE Control: CPU throttling prevented, count : ' + str(throttle_state['prevented']), level=xbmc.LOGINFO)
+    return 0
+
+
+def get_poll_interval(cputemp, thresholds, poll_state):
+    """
+    This function returns the seconds until the next temperature check within poll_bounds.
+    The interval shrinks close to the nearest fan curve threshold, if the temperature slope
+    reaches a threshold soon and with the CPU load since the previous call.
+    The poll_state dict keeps the previous sample between the calls.
+    """
+    now = time.monotonic()
+    if 'time' in poll_state and now > poll_state['time']:
+        slope = (cputemp - poll_state['temp']) / (now - poll_state['time'])
+        poll_state['slope'] = (poll_state.get('slope', slope) + slope) / 2
+    poll_state['time'] = now
+    poll_state['temp'] = cputemp
+    slope = poll_state.get('slope', 0)
+
+    interval = poll_bounds[1]
+    for threshold in thresholds:
+        distance = abs(threshold - cputemp)
+        interval = min(interval, poll_bounds[0] + distance * POLL_DISTANCE_FACTOR)
+        # Heading for the threshold: check again before half of the time to reach it
+        if (threshold - cputemp) * slope > 0:
+            interval = min(interval, distance / abs(slope) / 2)
+    load = argonsysinfo_getcpuload(poll_state)
+    if load is not None:
+        interval = interval * (1 - POLL_LOAD_FACTOR * load)
+    return int(max(poll_bounds[0], min(poll_bounds[1], interval)))
+
+
+def shadow_tick(primaryspeed, shadowspeed, emergency, shadow_state):
+    """
+    This function runs one temperature check of the shadow policy through the same write and
+    delay steps as fan_control: a higher fan speed is set right away, a lower one after
+    LOWERING_DELAY seconds without checks in between, and the thermal watchdog runs the fan at
+    full speed until it hands back. The shadow fan speed is never written, shadow_primary records
+    the fan speeds actually written for the primary policy, primaryspeed is the fan speed set
+    when the shadow policy starts. It takes constant time per call.
+    """
+    now = time.monotonic()
+    if 'time' not in shadow_state:
+        shadow_state.update({'time': now, 'primary': primaryspeed, 'shadow': -1, 'lowering': None})
+        shadow_reset(shadow_state)
+    lowering = shadow_state['lowering']
+    if lowering is not None and now >= lowering[0]:
+        # Set in between the checks
+        shadow_account(shadow_state, lowering[0])
+        shadow_write(shadow_state, lowering[1])
+        shadow_state['lowering'] = None
+    shadow_account(shadow_state, now)
+    if emergency:
+        shadow_state['shadow'] = 100
+        shadow_state['lowering'] = None
+    elif shadow_state['lowering'] is not None:
+        # Still waiting like fan_control does
+        return
+    elif shadowspeed > shadow_state['shadow']:
+        shadow_write(shadow_state, shadowspeed)
+    elif shadowspeed < shadow_state['shadow']:
+        shadow_state['lowering'] = (now + LOWERING_DELAY, shadowspeed)
+
+
+def shadow_primary(shadow_state, speed, written=True):
+    """Record a fan speed set for the primary policy, not written by fan_control while the watchdog runs"""
+    if 'time' not in shadow_state:
+        return
+    shadow_account(shadow_state, time.monotonic())
+    if written and speed != shadow_state['primary']:
+        shadow_state['primarywrites'] = shadow_state['primarywrites'] + 1
+    shadow_state['primary'] = speed
+
+
+def shadow_write(shadow_state, speed):
+    """Count a fan speed the shadow policy would have written"""
+    shadow_state['shadowwrites'] = shadow_state['shadowwrites'] + 1
+    shadow_state['shadow'] = speed
+    xbmc.log(msg='Argon ONE Control: shadow fan speed write : ' + str(speed) + ', primary fan speed : ' + str(shadow_state['primary']), level=xbmc.LOGDEBUG)
+
+
+def shadow_account(shadow_state, now):
+    """
+    Add the time since the last update with the fan speeds set by both policies, the divergence
+    is weighted with the time, so the statistics don't depend on the polling interval.
+    """
+    elapsed = now - shadow_state['time']
+    shadow_state['time'] = now
+    if shadow_state['primary'] < 0 or shadow_state['shadow'] < 0:
+        return
+    difference = abs(shadow_state['primary'] - shadow_state['shadow'])
+    shadow_state['duration'] = shadow_state['duration'] + elapsed
+    shadow_state['differencetime'] = shadow_state['differencetime'] + difference * elapsed
+    if difference > 0:
+        shadow_state['divergedtime'] = shadow_state['divergedtime'] + elapsed
+    shadow_state['maxdifference'] = max(shadow_state['maxdifference'], difference)
+
+
+def shadow_reset(shadow_state):
+    """Start the statistics over, the fan speeds of both policies are kept"""
+    shadow_state.update({'duration': 0, 'differencetime': 0, 'divergedtime': 0, 'maxdifference': 0, 'primarywrites': 0, 'shadowwrites': 0})
+
+
+def shadow_report(shadow_state):
+    """Log the divergence of the shadow policy and start over"""
+    if shadow_state.get('duration', 0) <= 0:
+        return
+    xbmc.log(msg='Argon ONE Control: shadow policy over {:.0f} s : diverged {:.1f} % of the time, mean difference {:.1f} %, maximum difference {} %, fan speed changes {} (primary {})'.format(
+        shadow_state['duration'], 100 * shadow_state['divergedtime'] / shadow_state['duration'], shadow_state['differencetime'] / shadow_state['duration'],
+        shadow_state['maxdifference'], shadow_state['shadowwrites'], shadow_state['primarywrites']), level=xbmc.LOGINFO)
+    shadow_reset(shadow_state)
+
+
+def load_fan_controllers(ADDON, temperature_unit):
+    """
+    This function returns the additional fan controllers of the settings, each with its I2C bus,
+    address and fan curve. A controller without fan curve follows the fan speed of the Argon ONE.
+    A controller without address or at the address of the Argon ONE itself is skipped.
+    """
+    controllers = []
+    for slot in range(1, FAN_CONTROLLER_SLOTS+1):
+        if not ADDON.getSettingBool('fan{}'.format(slot)):
+            continue
+        busnum = ADDON.getSettingInt('fan{}_bus'.format(slot))
+        address = ADDON.getSetting('fan{}_address'.format(slot)).strip()
+        if address == '':
+            xbmc.log(msg='Argon ONE Control: fan {} has no I2C address yet'.format(slot), level=xbmc.LOGDEBUG)
+            continue
+        try:
+            address = int(address, 16)
+        except ValueError:
+            address = -1
+        if address < 0x03 or address > 0x77:
+            xbmc.log(msg='Argon ONE Control: fan {} has no valid I2C address'.format(slot), level=xbmc.LOGWARNING)
+            continue
+        busobj, lock = get_i2c_bus(busnum)
+        if busobj is not None and busobj is bus and address == ADDR_ARGONONEFAN:
+            # Same device as the Argon ONE, which follows the main fan curve already
+            xbmc.log(msg='Argon ONE Control: fan {} is the Argon ONE itself (bus {}, 0x{:02x}), skipped'.format(slot, busnum, address), level=xbmc.LOGWARNING)
+            continue
+        if busobj is None:
+            xbmc.log(msg='Argon ONE Control: fan {} I2C bus {} not available'.format(slot, busnum), level=xbmc.LOGWARNING)
+        controllers.append({
+            "name": 'fan {} (bus {}, 0x{:02x})'.format(slot, busnum, address),
+            "bus": busnum,
+            "address": address,
+            "busobj": busobj,
+            "lock": lock,
+            "regsupport": False,
+            "sensor": ADDON.getSetting('fan{}_sensor'.format(slot)).strip() or 'CPU',
+            "curve": parse_curve(ADDON.getSetting('fan{}_curve'.format(slot)), temperature_unit),
+            "speed": -1,
+        })
+    return controllers
+
+
 def load_config():
     """
     This function retrieves the fanspeed configuration list from a file, arranged by temperature.
@@ -303,8 +744,27 @@ def load_config():
 
     global power_button_mon
     global powerbutton_remap
+    global gesture_actions
+    global emergency_temp
+    global emergency_hysteresis
+    global throttle_boost
+    global thermal_events_enabled
+    global playback_curves
+    global poll_bounds
+    global load_threshold
+    global load_fanspeed
+    global calibration_requested
+    global calibration_target
+    global shadow_curve
+    global shadow_sensor
+    global fan_controllers
+    global push_curves
+    global status_enabled
     powerbutton = ADDON.getSettingBool('powerbutton')
     powerbutton_remap = ADDON.getSettingBool('powerbutton_remap')
+    gesture_actions = {}
+    for gesture in ARGONBUTTON_GESTURES:
+        gesture_actions[gesture] = ADDON.getSetting('gesture_' + gesture).strip()
     if powerbutton:
         if not power_button_mon.is_set():
             xbmc.log(msg='Argon ONE Control: power button monitoring has been enabled', level=xbmc.LOGDEBUG)
@@ -316,18 +776,60 @@ def load_config():
     newhddconfig = []
     newgpuconfig = []
     newpmicconfig = []
+    newsensorconfig = []
 
+    temperature_unit = xbmc.getInfoLabel('System.TemperatureUnits')
+    if ADDON.getSettingBool('emergency'):
+        if temperature_unit == '°F':
+            emergency_temp = (float(ADDON.getSetting('emergency_tempf'))-32.0) * 5.0/9.0
+        else:
+            emergency_temp = float(ADDON.getSetting('emergency_temp'))
+        emergency_hysteresis = int(ADDON.getSetting('emergency_hysteresis'))
+    else:
+        emergency_temp = 0
+
+    thermal_events_enabled = ADDON.getSettingBool('thermal_events')
+    status_enabled = ADDON.getSettingBool('status_publish')
     cmdset_legacy = ADDON.getSettingBool('cmdset_legacy')
+    throttle_boost = False
+    playback_curves = {}
+    poll_bounds = []
+    load_threshold = 0
+    calibration_requested = False
+    shadow_curve = []
+    push_curves = {}
+    fan_controllers = load_fan_controllers(ADDON, temperature_unit)
     fanspeed_disable = ADDON.getSettingBool('fanspeed_disable')
-    if fanspeed_disable:
-        return [['90=100'], newgpuconfig, newhddconfig, newpmicconfig, cmdset_legacy]
     fanspeed_alwayson = ADDON.getSettingBool('fanspeed_alwayson')
+    if fanspeed_disable or fanspeed_alwayson:
+        # All fans follow the Argon ONE
+        for controller in fan_controllers:
+            controller['curve'] = []
+    if fanspeed_disable:
+        return [['90=100'], newgpuconfig, newhddconfig, newpmicconfig, cmdset_legacy, newsensorconfig]
     if fanspeed_alwayson:
-        return [['1=100'], newgpuconfig, newhddconfig, newpmicconfig, cmdset_legacy]
+        return [['1=100'], newgpuconfig, newhddconfig, newpmicconfig, cmdset_legacy, newsensorconfig]
     fanspeed_gpu = ADDON.getSettingBool('fanspeed_gpu')
     fanspeed_hdd = ADDON.getSettingBool('fanspeed_hdd')
     fanspeed_pmic = ADDON.getSettingBool('fanspeed_pmic')
-    temperature_unit = xbmc.getInfoLabel('System.TemperatureUnits')
+    throttle_boost = ADDON.getSettingBool('throttle_boost')
+    calibration_requested = ADDON.getSettingBool('calibrate')
+    if temperature_unit == '°F':
+        calibration_target = (float(ADDON.getSetting('calibration_targetf'))-32.0) * 5.0/9.0
+    else:
+        calibration_target = float(ADDON.getSetting('calibration_target'))
+    if ADDON.getSettingBool('load_feedforward'):
+        load_threshold = ADDON.getSettingInt('load_threshold')
+        load_fanspeed = ADDON.getSettingInt('load_fanspeed')
+    if ADDON.getSettingBool('adaptive_polling'):
+        poll_bounds = [ADDON.getSettingInt('poll_min'), max(ADDON.getSettingInt('poll_min'), ADDON.getSettingInt('poll_max'))]
+    if ADDON.getSettingBool('playback_profiles'):
+        playback_curves['idle'] = []
+        playback_curves['playback'] = parse_curve(ADDON.getSetting('playback_curve'), temperature_unit)
+        playback_curves['heavy'] = parse_curve(ADDON.getSetting('heavy_curve'), temperature_unit)
+    if ADDON.getSettingBool('shadow_mode'):
+        shadow_curve = parse_curve(ADDON.getSetting('shadow_curve'), temperature_unit)
+        shadow_sensor = ADDON.getSetting('shadow_sensor').strip() or 'CPU'
 
     configtype = ['a', 'b', 'c']
     for typekey in configtype:
@@ -363,25 +865,128 @@ def load_config():
     if len(newpmicconfig) > 0:
         newpmicconfig.sort(reverse=True)
 
-    return [ newconfig, newgpuconfig, newhddconfig, newpmicconfig, cmdset_legacy ]
+    # Additional sensors, each as (sensor name, fan curve)
+    for slot in range(1, EXTRA_SENSOR_SLOTS+1):
+        if not ADDON.getSettingBool('sensor{}'.format(slot)):
+            continue
+        sensorname = ADDON.getSetting('sensor{}_name'.format(slot)).strip()
+        sensorconfig = parse_curve(ADDON.getSetting('sensor{}_curve'.format(slot)), temperature_unit)
+        if len(sensorname) > 0 and len(sensorconfig) > 0:
+            newsensorconfig.append((sensorname, sensorconfig))
+
+    # Temperatures pushed by other processes, see argonpush.py
+    newpushconfig = {}
+    if ADDON.getSettingBool('push_api'):
+        for slot in range(1, PUSH_SENSOR_SLOTS+1):
+            if not ADDON.getSettingBool('push{}'.format(slot)):
+                continue
+            sensorname = ADDON.getSetting('push{}_name'.format(slot)).strip()
+            sensorconfig = parse_curve(ADDON.getSetting('push{}_curve'.format(slot)), temperature_unit)
+            if len(sensorname) > 0 and len(sensorconfig) > 0:
+                newpushconfig[sensorname] = sensorconfig
+    push_curves = newpushconfig
+
+    return [ newconfig, newgpuconfig, newhddconfig, newpmicconfig, cmdset_legacy, newsensorconfig ]
+
+
+def read_sensors(sensors):
+    """
+    Read all given sensors one after the other in the calling thread.
+    The sensors are given as a list of (name, read function).
+    """
+    results = {}
+    for name, readfunc in sensors:
+        try:
+            results[name] = readfunc()
+        except Exception:
+            xbmc.log(msg='Argon ONE Control: ' + name + ' temperature not available', level=xbmc.LOGDEBUG)
+    return results
+
+
+def start_sensor_reads(executor, sensors, pending):
+    """
+    Start the reads of all given sensors concurrently, the results are collected by
+    collect_sensor_reads once they are done or SENSOR_DEADLINE has passed.
+    A sensor which isn't finished in time is left out and not started again while still running,
+    its late result is used in the next iteration instead.
+    The sensors are given as a list of (name, read function), pending keeps the running reads.
+    Returns the results of late reads and the started reads.
+    """
+    results = {}
+    started = {}
+    for name, readfunc in sensors:
+        if name in pending:
+            if not pending[name].done():
+                continue
+            if pending[name].exception() is None:
+                results[name] = pending[name].result()
+            del pending[name]
+        started[name] = executor.submit(readfunc)
+    return results, started
+
+
+def collect_sensor_reads(results, started, pending):
+    """Add the results of the finished reads of start_sensor_reads, the others become pending"""
+    for name in started:
+        future = started[name]
+        if future.done():
+            if future.exception() is None:
+                results[name] = future.result()
+        else:
+            xbmc.log(msg='Argon ONE Control: ' + name + ' temperature not available within the deadline', level=xbmc.LOGDEBUG)
+            pending[name] = future
+    return results
 
 
 def temp_check(abort_flag):
     """
     This function is the thread that monitors temperature and sets the fan speed.
+    The fan control steps of fan_control are separated by interruptible sleeps.
+    """
+    sensor_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='argonsensor')
+    for sleep_sec in fan_control(abort_flag, sensor_executor):
+        if isinstance(sleep_sec, list):
+            concurrent.futures.wait(sleep_sec, timeout=SENSOR_DEADLINE)
+        else:
+            thread_sleep(sleep_sec, abort_flag)
+    sensor_executor.shutdown(wait=False)
+
+
+def fan_control(abort_flag, sensor_executor, i2c_executor=None):
+    """
+    This function monitors temperature and sets the fan speed, it yields the seconds to sleep
+    until the next step. The sleep is cut short by a settings change or by fan_wakeup.
     The value is fed to get_fanspeed to get the new fan speed.
-    To prevent unnecessary fluctuations, lowering fan speed is delayed by 30 seconds.
+    To prevent unnecessary fluctuations, lowering fan speed is delayed by 30 seconds. A wakeup
+    during the delay checks the temperatures again, only a settings change skips the delay.
+    The sensors are read concurrently by sensor_executor, meanwhile the list of the running
+    reads is yielded, to be resumed once they are done or SENSOR_DEADLINE has passed.
+    Without sensor_executor the sensors are read one after the other. The same way the I2C
+    accesses run on i2c_executor, if given, see fan_io.
+    With a shadow curve, the same samples are also fed to the shadow policy, which replaces
+    the fan curve of shadow_sensor and is only compared with the primary fan speed.
 
     Location of config file varies based on OS
     """
     global fansettingupdate
+    global argonregsupport
+    global cpu_thresholds
 
     cmdset_detect = True
-    argonregsupport = True
+    # Command set of the additional fan controllers by (bus, address)
+    controller_cmdsets = {}
     fanconfig = ['65=100', '60=55', '55=10']
     fanhddconfig = ['50=100', '40=55', '30=30']
 
     prevspeed=-1
+    firstwrite = True
+    sensor_pending = {}
+    throttle_state = {}
+    poll_state = {}
+    shadow_state = {}
+    wakeups = 0
+    wakeupstart = time.monotonic()
+    xbmc.log(msg='Argon ONE Control: available temperature sensors : ' + ', '.join(argonsysinfo_listthermalsensors()), level=xbmc.LOGINFO)
 
     while True:
         tmpconfig = load_config()
@@ -409,66 +1014,554 @@ def temp_check(abort_flag):
         cmdset_legacy = tmpconfig[4]
         if cmdset_legacy:
             cmdset_detect = True
+            controller_cmdsets = {}
             argonregsupport = False
             xbmc.log(msg='Argon ONE Control: legacy command set only', level=xbmc.LOGDEBUG)
         else:
             if cmdset_detect:
                 xbmc.log(msg='Argon ONE Control: command set detection', level=xbmc.LOGDEBUG)
-                argonregsupport = argonregister_checksupport(bus)
+                argonregsupport = yield from fan_io(i2c_executor, check_cmdset, bus, bus_lock)
                 cmdset_detect = False
             xbmc.log(msg='Argon ONE Control: command set with register support : ' + str(argonregsupport), level=xbmc.LOGDEBUG)
+        controllers = fan_controllers
+        for controller in controllers:
+            if cmdset_legacy:
+                continue
+            cmdsetkey = (controller['bus'], controller['address'])
+            if cmdsetkey not in controller_cmdsets and controller['busobj'] is not None:
+                controller_cmdsets[cmdsetkey] = yield from fan_io(i2c_executor, check_cmdset, controller['busobj'], controller['lock'], controller['address'])
+                xbmc.log(msg='Argon ONE Control: ' + controller['name'] + ' command set with register support : ' + str(controller_cmdsets[cmdsetkey]), level=xbmc.LOGDEBUG)
+            controller['regsupport'] = controller_cmdsets.get(cmdsetkey, False)
+
+        # Fan curves of the enabled sensors: (name, read function, curve)
+        curves = [('CPU', argonsysinfo_getcputemp, fanconfig)]
+        if len(fangpuconfig) > 0:
+            curves.append(('GPU', argonsysinfo_getgputemp, fangpuconfig))
+        if len(fanhddconfig) > 0:
+            curves.append(('SSD/NVMe', argonsysinfo_getmaxhddtemp, fanhddconfig))
+        if len(fanpmicconfig) > 0:
+            curves.append(('PMIC', argonsysinfo_getpmictemp, fanpmicconfig))
+        for sensorname, sensorconfig in tmpconfig[5]:
+            curves.append((sensorname, functools.partial(argonsysinfo_getsensortemp, sensorname), sensorconfig))
+        for sensorname in push_curves:
+            curves.append((sensorname, functools.partial(get_push_temp, sensorname), push_curves[sensorname]))
+        cpu_thresholds = [float(curconfig.split('=')[0]) for curconfig in fanconfig]
+        if throttle_boost:
+            cpu_thresholds.append(THROTTLE_TEMP - THROTTLE_MARGIN)
+        sensors = [(name, readfunc) for name, readfunc, config in curves]
+        for controller in controllers:
+            if len(controller['curve']) > 0 and controller['sensor'] not in [sensor[0] for sensor in sensors]:
+                sensors.append((controller['sensor'], get_sensor_reader(controller['sensor'])))
+        if len(shadow_curve) == 0:
+            shadow_state.clear()
+        elif shadow_sensor not in [sensor[0] for sensor in sensors]:
+            sensors.append((shadow_sensor, get_sensor_reader(shadow_sensor)))
 
         fansettingupdate = False
+        if calibration_requested:
+            yield from fan_calibration(abort_flag, i2c_executor)
+            # Restore the fan speed of the curves
+            prevspeed = -1
         while not fansettingupdate:
-            # Speed based on CPU Temp
-            val = argonsysinfo_getcputemp()
-            xbmc.log(msg='Argon ONE Control: current CPU temperature : ' + str(val), level=xbmc.LOGDEBUG)
-            newspeed = get_fanspeed(val, fanconfig)
-            # Speed based on GPU Temp
-            val = argonsysinfo_getgputemp()
-            xbmc.log(msg='Argon ONE Control: current GPU temperature : ' + str(val), level=xbmc.LOGDEBUG)
-            gpuspeed = get_fanspeed(val, fangpuconfig)
-            # Speed based on SSD/NVMe Temp
-            val = argonsysinfo_getmaxhddtemp()
-            xbmc.log(msg='Argon ONE Control: current SSD/NVMe temperature : ' + str(val), level=xbmc.LOGDEBUG)
-            hddspeed = get_fanspeed(val, fanhddconfig)
-            # Speed based on PMIC Temp
-            val = argonsysinfo_getpmictemp()
-            xbmc.log(msg='Argon ONE Control: current PMIC temperature : ' + str(val), level=xbmc.LOGDEBUG)
-            pmicspeed = get_fanspeed(val, fanpmicconfig)
-            xbmc.log(msg='Argon ONE Control: CPU fan speed value : ' + str(newspeed), level=xbmc.LOGDEBUG)
-            xbmc.log(msg='Argon ONE Control: GPU fan speed value : ' + str(gpuspeed), level=xbmc.LOGDEBUG)
-            xbmc.log(msg='Argon ONE Control: SSD/NVMe fan speed value : ' + str(hddspeed), level=xbmc.LOGDEBUG)
-            xbmc.log(msg='Argon ONE Control: PMIC fan speed value : ' + str(pmicspeed), level=xbmc.LOGDEBUG)
-
-            # Use faster fan speed
-            if gpuspeed > newspeed:
-                newspeed = gpuspeed
-            if hddspeed > newspeed:
-                newspeed = hddspeed
-            if pmicspeed > newspeed:
-                newspeed = pmicspeed
-
-            if newspeed == prevspeed:
-                thread_sleep(30, abort_flag)
+            # Read all sensors at once, a slow sensor must not hold back the others
+            if sensor_executor is None:
+                temps = read_sensors(sensors)
+            else:
+                temps, started = start_sensor_reads(sensor_executor, sensors, sensor_pending)
+                yield list(started.values())
+                collect_sensor_reads(temps, started, sensor_pending)
+            fan_wakeup.clear()
+            newspeed = 0
+            replacedspeed = 0
+            for name, readfunc, config in curves:
+                if name not in temps:
+                    continue
+                xbmc.log(msg='Argon ONE Control: current ' + name + ' temperature : ' + str(temps[name]), level=xbmc.LOGDEBUG)
+                speed = get_fanspeed(temps[name], config)
+                xbmc.log(msg='Argon ONE Control: ' + name + ' fan speed value : ' + str(speed), level=xbmc.LOGDEBUG)
+                # The fan curve which the shadow policy replaces is added last
+                if len(shadow_curve) > 0 and name == shadow_sensor:
+                    replacedspeed = max(replacedspeed, speed)
+                # Use faster fan speed
+                elif speed > newspeed:
+                    newspeed = speed
+            profilecurve = playback_curves.get(playback_profile, [])
+            if len(profilecurve) > 0 and 'CPU' in temps:
+                speed = get_fanspeed(temps['CPU'], profilecurve)
+                xbmc.log(msg='Argon ONE Control: ' + playback_profile + ' profile fan speed value : ' + str(speed), level=xbmc.LOGDEBUG)
+                if speed > newspeed:
+                    newspeed = speed
+            if throttle_boost and 'CPU' in temps:
+                speed = get_throttle_fanspeed(temps['CPU'], throttle_state)
+                xbmc.log(msg='Argon ONE Control: throttle fan speed value : ' + str(speed), level=xbmc.LOGDEBUG)
+                if speed > newspeed:
+                    newspeed = speed
+            if load_threshold > 0 and load_high:
+                xbmc.log(msg='Argon ONE Control: CPU load fan speed value : ' + str(load_fanspeed), level=xbmc.LOGDEBUG)
+                if load_fanspeed > newspeed:
+                    newspeed = load_fanspeed
+            if len(shadow_curve) > 0 and shadow_sensor in temps:
+                shadow_tick(prevspeed, max(newspeed, get_fanspeed(temps[shadow_sensor], shadow_curve)), emergency_fan.is_set(), shadow_state)
+            if replacedspeed > newspeed:
+                newspeed = replacedspeed
+            status_sample(temps, 100 if emergency_fan.is_set() else newspeed)
+            # Fan speeds of the additional controllers, unchanged without their sensor
+            controllerspeeds = []
+            for controller in controllers:
+                speed = newspeed
+                if len(controller['curve']) > 0:
+                    if controller['sensor'] in temps:
+                        speed = get_fanspeed(temps[controller['sensor']], controller['curve'])
+                    else:
+                        speed = controller['speed']
+                controllerspeeds.append(speed)
+            controllerlowering = False
+            controllerchanged = False
+            for idx in range(len(controllers)):
+                if controllers[idx]['busobj'] is not None and controllerspeeds[idx] != controllers[idx]['speed']:
+                    controllerchanged = True
+                    controllerlowering = controllerlowering or controllerspeeds[idx] < controllers[idx]['speed']
+            if len(poll_bounds) > 0 and 'CPU' in temps:
+                thresholds = cpu_thresholds + [float(curconfig.split('=')[0]) for curconfig in profilecurve]
+                pollinterval = get_poll_interval(temps['CPU'], thresholds, poll_state)
+                xbmc.log(msg='Argon ONE Control: next temperature check in ' + str(pollinterval) + ' s', level=xbmc.LOGDEBUG)
+            else:
+                pollinterval = 30
+            wakeups = wakeups + 1
+            if time.monotonic() - wakeupstart >= 3600:
+                xbmc.log(msg='Argon ONE Control: temperature checks in the last hour : ' + str(wakeups), level=xbmc.LOGINFO)
+                shadow_report(shadow_state)
+                wakeups = 0
+                wakeupstart = time.monotonic()
+
+            if emergency_fan.is_set():
+                # The watchdog keeps the fan at full speed until it hands back
+                prevspeed = 100
+                shadow_primary(shadow_state, prevspeed, False)
+                yield 30
+                if abort_flag.is_set():
+                    break
+                continue
+            if newspeed == prevspeed and not controllerchanged:
+                if thermal_event_active.is_set() and len(curves) == 1 and not throttle_state.get('boost', False):
+                    # Woken up by the thermal notifications if a threshold is crossed or the firmware throttles
+                    yield EVENT_POLL_INTERVAL
+                elif len(poll_bounds) == 0 and len(playback_curves) > 0 and playback_profile == 'idle':
+                    # Woken up by the player if a playback starts
+                    yield IDLE_POLL_INTERVAL
+                else:
+                    yield pollinterval
                 if abort_flag.is_set():
                     break
                 continue
-            elif newspeed < prevspeed:
-                thread_sleep(30, abort_flag)
+            elif newspeed < prevspeed or controllerlowering:
+                yield LOWERING_DELAY
+                if abort_flag.is_set():
+                    break
+                if fan_wakeup.is_set() and not fansettingupdate:
+                    # Woken up early, i.e. by a rising temperature: check again and restart the delay
+                    continue
             try:
-                argonregister_setfanspeed(bus, newspeed, argonregsupport)
-                thread_sleep(30, abort_flag)
-                prevspeed = newspeed
+                if newspeed != prevspeed:
+                    if not (yield from fan_io(i2c_executor, set_fanspeed, newspeed)):
+                        continue
+                    if firstwrite:
+                        firstwrite = False
+                        xbmc.log(msg='Argon ONE Control: first fan speed write after {:.0f} ms'.format((time.monotonic()-startup_time)*1000), level=xbmc.LOGINFO)
+                    prevspeed = newspeed
+                    shadow_primary(shadow_state, prevspeed)
+                yield from fan_io(i2c_executor, set_controller_speeds, controllers, controllerspeeds)
+                yield pollinterval
             except IOError:
                 temp = ''
-                thread_sleep(60, abort_flag)
+                yield 60
             if abort_flag.is_set():
                 break
+        # The shadow curve may have changed with the settings
+        shadow_report(shadow_state)
         if abort_flag.is_set():
             break
 
 
+def fan_calibration(abort_flag, i2c_executor=None):
+    """
+    This function runs the step tests of the fan calibration, it yields the seconds to sleep
+    like fan_control. Each duty level is held for ARGONCALIBRATE_HOLD seconds, while the CPU
+    temperature is sampled every ARGONCALIBRATE_SAMPLE seconds. The steady state temperatures
+    of the fitted models give the proposed CPU fan curve, which is written to the settings.
+    A duty level which reaches the target temperature ends the step tests early, a settings
+    change or the thermal watchdog cancel the calibration.
+    """
+    global fansettingupdate
+    xbmc.log(msg='Argon ONE Control: fan calibration started, target temperature : ' + str(calibration_target), level=xbmc.LOGINFO)
+    steadystates = {}
+    for duty in ARGONCALIBRATE_LEVELS:
+        try:
+            if not (yield from fan_io(i2c_executor, set_fanspeed, duty)):
+                break
+        except IOError:
+            xbmc.log(msg='Argon ONE Control: fan calibration failed, fan speed not set', level=xbmc.LOGWARNING)
+            xbmcaddon.Addon().setSettingBool('calibrate', False)
+            return
+        samples = []
+        starttime = time.monotonic()
+        toohot = False
+        while time.monotonic() - starttime < ARGONCALIBRATE_HOLD:
+            fan_wakeup.clear()
+            cputemp = argonsysinfo_getcputemp()
+            samples.append((time.monotonic() - starttime, cputemp))
+            if cputemp >= calibration_target or emergency_fan.is_set():
+                toohot = True
+                break
+            yield ARGONCALIBRATE_SAMPLE
+            if abort_flag.is_set():
+                # Started again with the service
+                xbmc.log(msg='Argon ONE Control: fan calibration cancelled', level=xbmc.LOGINFO)
+                return
+            if fansettingupdate:
+                xbmc.log(msg='Argon ONE Control: fan calibration cancelled by a settings change', level=xbmc.LOGINFO)
+                xbmcaddon.Addon().setSettingBool('calibrate', False)
+                return
+        steadytemp, tau = argoncalibrate_fit(samples)
+        if toohot:
+            steadytemp = max(cputemp, steadytemp if steadytemp is not None else cputemp)
+        steadystates[duty] = steadytemp
+        xbmc.log(msg='Argon ONE Control: fan calibration duty ' + str(duty) + ' : steady state temperature ' + str(steadytemp) + ', time constant ' + str(tau), level=xbmc.LOGINFO)
+        if toohot:
+            # The lower duty levels only get hotter
+            break
+    if emergency_fan.is_set() or len(steadystates) == 0:
+        xbmc.log(msg='Argon ONE Control: fan calibration cancelled by the thermal watchdog', level=xbmc.LOGWARNING)
+        xbmcaddon.Addon().setSettingBool('calibrate', False)
+        return
+
+    curve = argoncalibrate_curve(steadystates, calibration_target)
+    xbmc.log(msg='Argon ONE Control: fan calibration proposed curve : ' + str(curve), level=xbmc.LOGINFO)
+    ADDON = xbmcaddon.Addon()
+    for typekey, (tempval, fanval) in zip(['a', 'b', 'c'], curve):
+        ADDON.setSettingInt('cputemp_'+typekey, tempval)
+        ADDON.setSettingInt('cputempf_'+typekey, int(round(tempval * 9.0/5.0 + 32.0)))
+        ADDON.setSettingInt('fanspeed_'+typekey, fanval)
+    ADDON.setSettingBool('calibrate', False)
+    fansettingupdate = True
+
+
+def thermal_watchdog(abort_flag):
+    """
+    This function is the thread that guards against temperature spikes between the fan control cycles.
+    Only the CPU temperature is sampled every WATCHDOG_INTERVAL seconds. Above the critical temperature
+    the fan is set to 100% immediately and temp_check is held back, until the temperature has dropped
+    below the critical temperature minus the hysteresis.
+    """
+    while not abort_flag.wait(WATCHDOG_INTERVAL):
+        watchdog_check()
+        load_check()
+    emergency_fan.clear()
+
+
+def watchdog_check(i2c_executor=None):
+    """Take one CPU temperature sample of the thermal watchdog, the fans are written on i2c_executor if given"""
+    if emergency_temp <= 0:
+        if emergency_fan.is_set():
+            emergency_fan.clear()
+            fan_wakeup.set()
+        return
+    val = argonsysinfo_getcputemp()
+    if not emergency_fan.is_set():
+        if val < emergency_temp:
+            return
+        xbmc.log(msg='Argon ONE Control: critical CPU temperature : ' + str(val) + ', emergency fan started', level=xbmc.LOGWARNING)
+        emergency_fan.set()
+        fan_wakeup.set()
+        if i2c_executor is None:
+            emergency_write()
+        else:
+            i2c_executor.submit(emergency_write)
+    elif val < emergency_temp - emergency_hysteresis:
+        xbmc.log(msg='Argon ONE Control: CPU temperature : ' + str(val) + ', emergency fan stopped', level=xbmc.LOGWARNING)
+        emergency_fan.clear()
+        fan_wakeup.set()
+
+
+def emergency_write():
+    """Run all fans at full speed for the thermal watchdog"""
+    try:
+        with bus_lock:
+            argonregister_setfanspeed(bus, 100, argonregsupport)
+    except IOError:
+        # retry with the next sample
+        emergency_fan.clear()
+        return
+    controllers = fan_controllers
+    set_controller_speeds(controllers, [100] * len(controllers))
+
+
+def load_check():
+    """
+    Sample the CPU load of all cores every LOAD_WINDOW seconds from the /proc/stat deltas,
+    temp_check is woken up once the load crosses load_threshold in either direction.
+    """
+    global load_high
+    if load_threshold <= 0:
+        load_state.clear()
+        load_high = False
+        return
+    now = time.monotonic()
+    if now - load_state.get('time', 0) < LOAD_WINDOW:
+        return
+    load_state['time'] = now
+    load = argonsysinfo_getcpuload(load_state)
+    if load is None or (load*100 >= load_threshold) == load_high:
+        return
+    load_high = not load_high
+    xbmc.log(msg='Argon ONE Control: CPU load : {:.0f}%, feed-forward '.format(load*100) + ('on' if load_high else 'off'), level=xbmc.LOGDEBUG)
+    fan_wakeup.set()
+
+
+def thermal_events(abort_flag, subscriber=None):
+    """
+    This function is the thread that receives the kernel thermal netlink notifications.
+    temp_check is woken up on trip point events and if a sampled temperature of thermal_zone0
+    crosses a threshold of the CPU fan curve. Without kernel support temp_check keeps polling.
+    A stand-in subscriber from argonthermal_openlocal can be passed for testing.
+    """
+    lasttemp = None
+    unsupported = False
+    while not abort_flag.is_set():
+        if not thermal_events_enabled:
+            if subscriber is not None:
+                argonthermal_close(subscriber)
+                subscriber = None
+                thermal_event_active.clear()
+            unsupported = False
+            abort_flag.wait(1)
+            continue
+        if subscriber is None:
+            if unsupported:
+                abort_flag.wait(1)
+                continue
+            subscriber = argonthermal_open()
+            if subscriber is None:
+                xbmc.log(msg='Argon ONE Control: thermal netlink not supported, polling only', level=xbmc.LOGINFO)
+                unsupported = True
+                continue
+            xbmc.log(msg='Argon ONE Control: thermal netlink notifications subscribed', level=xbmc.LOGDEBUG)
+            thermal_event_active.set()
+
+        lasttemp = thermal_event_dispatch(argonthermal_read(subscriber, 1, stop_pipe[0]), lasttemp)
+    argonthermal_close(subscriber)
+    thermal_event_active.clear()
+
+
+def push_receiver(abort_flag):
+    """
+    This function is the thread that receives the temperatures pushed by other processes.
+    The socket is open while pushed temperatures with a fan curve are configured.
+    """
+    sock = None
+    retrystate = {}
+    while not abort_flag.is_set():
+        if len(push_curves) == 0:
+            if sock is not None:
+                argonpush_close(sock)
+                sock = None
+            retrystate.clear()
+            abort_flag.wait(1)
+            continue
+        if sock is None:
+            sock = push_open(retrystate)
+            if sock is None:
+                abort_flag.wait(1)
+                continue
+
+        push_dispatch(argonpush_read(sock, 1, stop_pipe[0]))
+    argonpush_close(sock)
+
+
+def push_open(retrystate):
+    """
+    Open the push socket, unless the retry after a failed open isn't due yet. The socket is
+    unavailable while another instance still receives on it, the retries back off up to
+    ARGONPUSH_RETRY_MAX seconds.
+    """
+    now = time.monotonic()
+    if now < retrystate.get('due', 0):
+        return None
+    sock = argonpush_open()
+    if sock is None:
+        level = xbmc.LOGDEBUG if 'delay' in retrystate else xbmc.LOGWARNING
+        delay = argonpush_retry(retrystate, now)
+        xbmc.log(msg='Argon ONE Control: temperature push socket ' + ARGONPUSH_SOCKET + ' not available, retry in {:.0f} s'.format(delay), level=level)
+        return None
+    retrystate.clear()
+    xbmc.log(msg='Argon ONE Control: temperature push socket ' + ARGONPUSH_SOCKET + ' opened', level=xbmc.LOGDEBUG)
+    return sock
+
+
+def push_dispatch(readings):
+    """Store the pushed temperatures with a fan curve, temp_check is woken up if a fan speed changes"""
+    wakeup = False
+    curves = push_curves
+    with push_lock:
+        for name, temp, expiry in readings:
+            if name not in curves:
+                xbmc.log(msg='Argon ONE Control: pushed temperature ' + name + ' has no fan curve', level=xbmc.LOGDEBUG)
+                continue
+            if name not in push_readings or get_fanspeed(temp, curves[name]) != get_fanspeed(push_readings[name][0], curves[name]):
+                wakeup = True
+        argonpush_store(push_readings, [reading for reading in readings if reading[0] in curves], time.monotonic())
+    if wakeup:
+        fan_wakeup.set()
+
+
+def get_push_temp(name):
+    """Return the pushed temperature, ValueError if it hasn't been pushed or has expired"""
+    with push_lock:
+        return argonpush_get(push_readings, name, time.monotonic())
+
+
+def status_refresher(abort_flag):
+    """
+    This function is the thread that publishes the system status every STATUS_INTERVAL seconds,
+    as home window properties and as JSON file. The properties are cleared on stop.
+    """
+    status_state = {}
+    while not abort_flag.wait(STATUS_INTERVAL):
+        status_refresh(status_state)
+    status_clear(status_state)
+
+
+def status_sample(temps, fanspeed):
+    """Keep the temperatures and the fan speed of a fan control step for the system status"""
+    with status_lock:
+        status_samples["temps"] = dict(temps)
+        status_samples["fanspeed"] = fanspeed
+
+
+def status_refresh(status_state):
+    """
+    This function collects the system status without blocking: the temperatures and the fan speed
+    are the last samples of the fan control, the CPU usage is taken since the previous refresh
+    instead of sleeping for a second. The storage usage, the RAID state and the IP address change
+    slowly and are refreshed every STATUS_SLOW_INTERVAL seconds only, the RAID state every time
+    while an array rebuilds so that its progress stays current.
+    """
+    if not status_enabled:
+        status_clear(status_state)
+        return
+    now = time.monotonic()
+    snapshot = {}
+    with status_lock:
+        temps = status_samples["temps"]
+        fanspeed = status_samples["fanspeed"]
+    # In the unit of the regional settings, like the fan curves
+    unit = xbmc.getInfoLabel('System.TemperatureUnits')
+    for name in temps:
+        temp = temps[name] * 9.0/5.0 + 32.0 if unit == '°F' else temps[name]
+        snapshot['Temperature.' + status_key(name)] = '{:.1f}'.format(temp)
+    snapshot['Temperature.Unit'] = '°F' if unit == '°F' else '°C'
+    if fanspeed is not None:
+        snapshot['FanSpeed'] = str(fanspeed)
+    for usage in argonsysinfo_listcpuusagesince(status_state.setdefault('cpu', {})):
+        snapshot['CPU.' + status_key(usage["title"])] = str(usage["value"])
+    ram = argonsysinfo_getram()
+    if isinstance(ram, list):
+        snapshot['RAM.Free'] = ram[0]
+        snapshot['RAM.Total'] = ram[1]
+
+    rebuilding = argonsysinfo_israidrebuilding()
+    if now >= status_state.get('slowdue', 0) or rebuilding or status_state.get('rebuilding'):
+        slow = {}
+        storage = argonsysinfo_listhddusage()
+        for devname in storage:
+            prefix = 'Storage.' + status_key(devname) + '.'
+            slow[prefix + 'Used'] = argonsysinfo_kbstr(storage[devname]['used'])
+            slow[prefix + 'Total'] = argonsysinfo_kbstr(storage[devname]['total'])
+            if storage[devname]['total'] > 0:
+                slow[prefix + 'Percent'] = str(int(100*storage[devname]['used']/storage[devname]['total']))
+        for raid in argonsysinfo_listraid()["raidlist"]:
+            slow['RAID.' + status_key(raid["title"]) + '.Level'] = raid["value"]
+            slow['RAID.' + status_key(raid["title"]) + '.State'] = raid["info"]["state"]
+            slow['RAID.' + status_key(raid["title"]) + '.Devices'] = str(raid["info"]["working"]) + '/' + str(raid["info"]["expected"])
+            if raid["info"]["rebuildstat"]:
+                slow['RAID.' + status_key(raid["title"]) + '.Rebuild'] = raid["info"]["rebuildstat"]
+        slow['IP'] = argonsysinfo_getip()
+        status_state['slow'] = slow
+        status_state['slowdue'] = now + STATUS_SLOW_INTERVAL
+    status_state['rebuilding'] = rebuilding
+    snapshot.update(status_state['slow'])
+    snapshot['RAID.Rebuilding'] = 'true' if rebuilding else 'false'
+    status_publish(snapshot, status_state)
+
+
+def status_key(name):
+    """Property name part of a sensor or device name, i.e. SSD/NVMe to SSD_NVMe"""
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def status_publish(snapshot, status_state):
+    """Set the changed home window properties and replace the JSON file"""
+    published = status_state.get('published', {})
+    if xbmcgui is not None:
+        window = xbmcgui.Window(10000)
+        for key in published:
+            if key not in snapshot:
+                window.clearProperty(STATUS_PROPERTY_PREFIX + key)
+        for key in snapshot:
+            if published.get(key) != snapshot[key]:
+                window.setProperty(STATUS_PROPERTY_PREFIX + key, snapshot[key])
+    status_state['published'] = snapshot
+    try:
+        tmpfile = STATUS_FILE + '.tmp'
+        with open(tmpfile, 'w') as fp:
+            json.dump({"time": int(time.time()), "status": snapshot}, fp, sort_keys=True)
+        os.replace(tmpfile, STATUS_FILE)
+    except OSError:
+        xbmc.log(msg='Argon ONE Control: status file ' + STATUS_FILE + ' not written', level=xbmc.LOGDEBUG)
+
+
+def status_clear(status_state):
+    """Remove the published properties and the JSON file"""
+    if 'published' not in status_state:
+        return
+    if xbmcgui is not None:
+        window = xbmcgui.Window(10000)
+        for key in status_state['published']:
+            window.clearProperty(STATUS_PROPERTY_PREFIX + key)
+    status_state.clear()
+    try:
+        os.unlink(STATUS_FILE)
+    except OSError:
+        pass
+
+
+def thermal_event_dispatch(events, lasttemp):
+    """
+    Wake up temp_check on the received thermal notifications, returns the last thermal_zone0 temperature.
+    With throttle_boost, the firmware throttling state is polled with each temperature sample as well.
+    """
+    global event_throttled
+    for event in events:
+        if event["cmd"] in (THERMAL_GENL_EVENT_TZ_TRIP_UP, THERMAL_GENL_EVENT_TZ_TRIP_DOWN):
+            xbmc.log(msg='Argon ONE Control: thermal zone ' + str(event["tz"]) + ' trip point ' + str(event["trip"]) + ' crossed', level=xbmc.LOGDEBUG)
+            fan_wakeup.set()
+        elif event["cmd"] == THERMAL_GENL_SAMPLING_TEMP and event["tz"] == 0 and event["temp"] is not None:
+            curtemp = event["temp"]/1000
+            if lasttemp is not None:
+                for threshold in cpu_thresholds:
+                    if min(lasttemp, curtemp) < threshold <= max(lasttemp, curtemp):
+                        fan_wakeup.set()
+                        break
+            lasttemp = curtemp
+            if throttle_boost:
+                throttled = argonsysinfo_getthrottled()
+                throttled = throttled > 0 and (throttled & 0xE) != 0
+                if throttled != event_throttled:
+                    event_throttled = throttled
+                    fan_wakeup.set()
+    return lasttemp
+
+
 def checksetup():
     """Used to enabled i2c and UART"""
     configfile = '/flash/config.txt'
@@ -481,6 +1574,8 @@ def checksetup():
         removelircfile()
 
     # Check if i2c exists
+    if manifest_unchanged(configfile, [configfile]):
+        return()
     isenabled = False
     with open(configfile, 'r') as fp:
         for curline in fp:
@@ -493,6 +1588,7 @@ def checksetup():
                 isenabled = True
                 break
     if isenabled:
+        manifest_record(configfile, [configfile])
         return()
 
     os.system("mount -o remount,rw /flash")
@@ -501,36 +1597,21 @@ def checksetup():
         fp.write('enable_uart=1\n')
         fp.write('dtoverlay=gpio-ir,gpio_pin=23\n')
     os.system('mount -o remount,ro /flash')
+    manifest_record(configfile, [configfile])
 
 
 def copykeymapfile():
     """Copy RC keytable file to rc_keymaps directory"""
     srcfile = '/storage/.kodi/addons/service.argononecontrol/resources/data/argon40.toml'
     dstfile = '/storage/.config/rc_keymaps/argon40.toml'
-    if os.path.isfile(dstfile):
-        tmpdsthash = getFileHash(dstfile)
-        tmpsrchash = getFileHash(srcfile)
-        if tmpdsthash == tmpsrchash:
-            return()
-    try:
-        copyfile(srcfile, dstfile)
-    except:
-        return()
+    copyprovisionedfile(srcfile, dstfile)
 
 
 def copyrcmapsfile():
     """Copy RC maps conf file to directory .config"""
     srcfile = '/storage/.kodi/addons/service.argononecontrol/resources/data/rc_maps.cfg'
     dstfile = '/storage/.config/rc_maps.cfg'
-    if os.path.isfile(dstfile):
-        tmpdsthash = getFileHash(dstfile)
-        tmpsrchash = getFileHash(srcfile)
-        if tmpdsthash == tmpsrchash:
-            return()
-    try:
-        copyfile(srcfile, dstfile)
-    except:
-        return()
+    copyprovisionedfile(srcfile, dstfile)
 
 
 def mergercmapsfile():
@@ -540,6 +1621,8 @@ def mergercmapsfile():
     """
     srcfile = '/etc/rc_maps.cfg'
     dstfile = '/storage/.config/rc_maps.cfg'
+    if manifest_unchanged(dstfile, [dstfile]):
+        return()
     # Check if argon40 toml is already included
     if os.path.isfile(dstfile):
         isincluded = False
@@ -554,15 +1637,19 @@ def mergercmapsfile():
                     isincluded = True
                     break
         if isincluded:
+            manifest_record(dstfile, [dstfile])
             return()
-    else:
-        try:
-            copyfile(srcfile, dstfile)
-        except:
-            return()
+        srcfile = dstfile
 
-    with open(dstfile, 'a') as fp:
-        fp.write('gpio_ir_recv\t*\targon40.toml\n')
+    try:
+        with open(srcfile, 'r') as fp:
+            content = fp.read()
+    except:
+        return()
+    if content and not content.endswith('\n'):
+        content = content + '\n'
+    writefileatomic(dstfile, content + 'gpio_ir_recv\t*\targon40.toml\n')
+    manifest_record(dstfile, [dstfile])
 
 
 def removelircfile():
@@ -579,15 +1666,118 @@ def copyshutdownscript():
     """Copy Shutdown script to directory .config"""
     srcfile = '/storage/.kodi/addons/service.argononecontrol/resources/data/shutdown.sh'
     dstfile = '/storage/.config/shutdown.sh'
+    copyprovisionedfile(srcfile, dstfile)
+
+
+def copyprovisionedfile(srcfile, dstfile):
+    """
+    Copy the file if the content differs. Nothing is read if the manifest records
+    the same size and mtime for both files as at the last check.
+    """
+    if manifest_unchanged(dstfile, [srcfile, dstfile]):
+        return()
     if os.path.isfile(dstfile):
-        tmpdsthash = getFileHash(dstfile)
+        tmpdsthash = manifest_hash(dstfile, 1)
+        if tmpdsthash is None:
+            tmpdsthash = getFileHash(dstfile)
         tmpsrchash = getFileHash(srcfile)
         if tmpdsthash == tmpsrchash:
+            manifest_record(dstfile, [srcfile, dstfile], tmpsrchash)
             return()
     try:
-        copyfile(srcfile, dstfile)
+        tmpfile = dstfile + '.tmp'
+        copyfile(srcfile, tmpfile)
+        if os.path.isfile(dstfile):
+            copymode(dstfile, tmpfile)
+        os.replace(tmpfile, dstfile)
     except:
         return()
+    manifest_record(dstfile, [srcfile, dstfile], getFileHash(dstfile))
+
+
+def writefileatomic(fname, content):
+    """Write to a temporary file and rename it, so the file is never seen half written"""
+    tmpfile = fname + '.tmp'
+    try:
+        with open(tmpfile, 'w') as fp:
+            fp.write(content)
+        if os.path.isfile(fname):
+            copymode(fname, tmpfile)
+        os.replace(tmpfile, fname)
+    except:
+        return()
+
+
+def getFileStat(fname):
+    """Size and mtime of the file, None if missing"""
+    try:
+        stat = os.stat(fname)
+        return [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        return None
+
+
+def load_manifest():
+    """Read the provisioning manifest, start from scratch if missing or broken"""
+    global provision_manifest
+    try:
+        with open(MANIFEST_FILE, 'r') as fp:
+            provision_manifest = json.load(fp)
+        if not isinstance(provision_manifest, dict):
+            provision_manifest = {}
+    except (OSError, ValueError):
+        provision_manifest = {}
+    provision_manifest['changed'] = False
+
+
+def save_manifest():
+    """Write the provisioning manifest, if something has changed"""
+    global provision_manifest
+    if provision_manifest is None:
+        return
+    if provision_manifest.pop('changed', False):
+        try:
+            os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+            writefileatomic(MANIFEST_FILE, json.dumps(provision_manifest))
+        except OSError:
+            pass
+    provision_manifest = None
+
+
+def manifest_unchanged(key, files):
+    """True if the manifest records the current size and mtime of all files"""
+    if provision_manifest is None or not isinstance(provision_manifest.get(key), dict):
+        return False
+    stats = [getFileStat(fname) for fname in files]
+    return None not in stats and provision_manifest[key].get('stat') == stats
+
+
+def manifest_hash(key, fileidx):
+    """Recorded hash, if the file at fileidx is still unchanged since it was recorded"""
+    if provision_manifest is None or not isinstance(provision_manifest.get(key), dict):
+        return None
+    entry = provision_manifest[key]
+    stats = entry.get('stat', [])
+    if fileidx >= len(stats) or stats[fileidx] != getFileStat(key):
+        return None
+    return entry.get('hash')
+
+
+def manifest_record(key, files, filehash=None):
+    """Record size, mtime and hash of the files after a successful check"""
+    if provision_manifest is None:
+        return
+    stats = [getFileStat(fname) for fname in files]
+    if None in stats:
+        # Checked again next time
+        if key in provision_manifest:
+            del provision_manifest[key]
+            provision_manifest['changed'] = True
+        return
+    entry = {'stat': stats, 'hash': filehash}
+    if provision_manifest.get(key) != entry:
+        provision_manifest[key] = entry
+        provision_manifest['changed'] = True
 
 
 def getFileHash(fname):
@@ -611,28 +1801,251 @@ def cleanup():
     # gpiozero automatically restores the pin settings at the end of the script
 
 
-__addon__ = xbmcaddon.Addon()
-__addonname__ = __addon__.getAddonInfo('name')
-__icon__ = __addon__.getAddonInfo('icon')
+def startup():
+    """
+    Initialize the I2C bus, so the fan control threads can start right away.
+    The remote control/shutdown file provisioning and the GUI notification are
+    done by a background thread, which is returned.
+    """
+    global bus
+    global stop_pipe
+    argonregister_abort.clear()
+    runcmd_cancelled.clear()
+    stop_pipe = os.pipe()
+    bus = None
+    for busnum in ARGONREGISTER_BUSES:
+        bus = argonregister_initializebusobj(busnum)
+        if bus is not None:
+            # Shared with the additional fan controllers on the same bus
+            i2c_buses[busnum] = bus
+            i2c_locks[busnum] = bus_lock
+            break
+    xbmc.log(msg='Argon ONE Control: I2C bus ready after {:.0f} ms'.format((time.monotonic()-startup_time)*1000), level=xbmc.LOGDEBUG)
+    t = Thread(target=provision, args=(bus is None,), daemon=True)
+    t.start()
+    return t
+
 
-if bus is None:
-    checksetup()
-    # Send message to GUI about reboot required
-    msg_line = "I2C not enabled yet. Fan control requires a reboot."
-    msg_time = 15000 #in miliseconds
-    xbmc.executebuiltin('Notification(%s, %s, %d, %s)'%(__addonname__, msg_line, msg_time, __icon__))
-else:
-    # Respect user-specific remote control settings
-    lockfile = '/storage/.config/argon40_rc.lock'
-    if not os.path.exists(lockfile):
-        copykeymapfile()
-        mergercmapsfile()
-        removelircfile()
-    copyshutdownscript()
-
-    # Send message to GUI about add-on start
-    msg_line = "Fan control/power button event monitoring has started."
-    msg_time = 5000 #in miliseconds
-    xbmc.executebuiltin('Notification(%s, %s, %d, %s)'%(__addonname__, msg_line, msg_time, __icon__))
-    addon_count = addon_count + 1
-    xbmc.log(msg='Argon ONE Control: Add-on started. ' + str(addon_count), level=xbmc.LOGDEBUG)
+def request_stop():
+    """
+    Cut the I2C settle delays short, kill the running sensor commands and wake up
+    the threads blocked in select, so they can follow the abort flag right away.
+    """
+    argonregister_abort.set()
+    argonsysinfo_cancelcommands()
+    button_wakeup.set()
+    fan_wakeup.set()
+    if stop_pipe is not None:
+        os.write(stop_pipe[1], b'\0')
+
+
+def service_core(monitor, abort_flag, power_button):
+    """
+    This function runs the fan control, the thermal watchdog, the thermal notifications, the
+    temperature push socket, the status refresh and the gpiod power button monitoring in the
+    calling thread, multiplexed by one selectors loop instead of a thread each. The fan control
+    steps and the watchdog samples are timers of the loop.
+    The sensor reads and the I2C writes with their settle delays run on executors, whose finished
+    work wakes up the loop like a settings change does, so neither a slow sensor nor the I2C bus
+    holds back the watchdog and the button.
+    The button gestures are decoded from the gpiod edge event timestamps, with lgpio/gpiozero
+    shutdown_check keeps its own thread, which is returned for the caller to join.
+    Returns after Kodi has requested the abort or request_stop was called.
+    """
+    global core_pipe
+    global power_button_mon
+    power_button_mon = power_button
+    sel = selectors.DefaultSelector()
+    core_pipe = os.pipe()
+    os.set_blocking(core_pipe[1], False)
+    sel.register(core_pipe[0], selectors.EVENT_READ, 'settings')
+    sel.register(stop_pipe[0], selectors.EVENT_READ, 'stop')
+
+    button_thread = None
+    request = None
+    if gpiod_spec is not None:
+        try:
+            request = request_line(get_gpiochip(), SHUTDOWN_PIN)
+            sel.register(request.fd, selectors.EVENT_READ, 'button')
+            xbmc.log(msg='Argon ONE Control: power button monitoring via gpiod', level=xbmc.LOGDEBUG)
+        except OSError:
+            xbmc.log(msg='Argon ONE Control: gpiod line request failing', level=xbmc.LOGDEBUG)
+    else:
+        button_thread = Thread(target=shutdown_check, args=(abort_flag, power_button), daemon=True)
+        button_thread.start()
+
+    subscriber = None
+    unsupported = False
+    lasttemp = None
+    pushsock = None
+    pushretry = {}
+    status_state = {}
+
+    sensor_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='argonsensor')
+    # One worker, the I2C writes keep their order
+    i2c_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='argoni2c')
+    fan_waits = None
+    fan = fan_control(abort_flag, sensor_executor, i2c_executor)
+    fan_due = time.monotonic()
+    watchdog_due = fan_due + WATCHDOG_INTERVAL
+    status_due = fan_due + STATUS_INTERVAL
+    abort_due = fan_due + CORE_MAX_WAIT
+    stopped = False
+    while not stopped:
+        # The thermal notifications follow the setting, which is loaded by fan_control
+        if thermal_events_enabled and subscriber is None and not unsupported:
+            subscriber = argonthermal_open()
+            if subscriber is None:
+                xbmc.log(msg='Argon ONE Control: thermal netlink not supported, polling only', level=xbmc.LOGINFO)
+                unsupported = True
+            else:
+                xbmc.log(msg='Argon ONE Control: thermal netlink notifications subscribed', level=xbmc.LOGDEBUG)
+                sel.register(subscriber[0], selectors.EVENT_READ, 'thermal')
+                thermal_event_active.set()
+                lasttemp = None
+        elif not thermal_events_enabled:
+            if subscriber is not None:
+                sel.unregister(subscriber[0])
+                argonthermal_close(subscriber)
+                subscriber = None
+                thermal_event_active.clear()
+            unsupported = False
+        # The push socket follows the pushed temperatures of the settings
+        if len(push_curves) > 0 and pushsock is None:
+            pushsock = push_open(pushretry)
+            if pushsock is not None:
+                sel.register(pushsock, selectors.EVENT_READ, 'push')
+        elif len(push_curves) == 0:
+            if pushsock is not None:
+                sel.unregister(pushsock)
+                argonpush_close(pushsock)
+                pushsock = None
+            pushretry.clear()
+
+        now = time.monotonic()
+        timeout = min(fan_due, watchdog_due, status_due, abort_due) - now
+        if request is not None:
+            with button_lock:
+                tap_timeout = argonbutton_timeout(button_state, time.monotonic_ns())
+            if tap_timeout is not None:
+                timeout = min(timeout, tap_timeout)
+        for key, _event in sel.select(max(0, timeout)):
+            if key.data == 'settings':
+                os.read(key.fd, 64)
+            elif key.data == 'stop':
+                stopped = True
+            elif key.data == 'thermal':
+                lasttemp = thermal_event_dispatch(argonthermal_read(subscriber, 0), lasttemp)
+            elif key.data == 'push':
+                push_dispatch(argonpush_read(pushsock, 0))
+            elif key.data == 'button':
+                for event in request.read_edge_events():
+                    power_btn_edge(event.event_type is event.Type.RISING_EDGE, event.timestamp_ns)
+
+        if request is not None:
+            with button_lock:
+                gesture = argonbutton_expire(button_state, time.monotonic_ns())
+            if gesture is not None:
+                power_btn_gesture(gesture)
+
+        now = time.monotonic()
+        if now >= watchdog_due:
+            watchdog_check(i2c_executor)
+            load_check()
+            watchdog_due = now + WATCHDOG_INTERVAL
+        if fan_waits is not None:
+            # fan_control resumes once its sensor reads or I2C writes are done
+            if all(future.done() for future in fan_waits):
+                fan_due = now
+        elif fansettingupdate or fan_wakeup.is_set():
+            fan_due = now
+        if now >= fan_due:
+            step = next(fan)
+            if isinstance(step, list):
+                fan_waits = step
+                for future in fan_waits:
+                    future.add_done_callback(lambda future: core_wakeup())
+                fan_due = time.monotonic() + SENSOR_DEADLINE
+            else:
+                fan_waits = None
+                fan_due = time.monotonic() + step
+        if now >= status_due:
+            status_refresh(status_state)
+            status_due = time.monotonic() + STATUS_INTERVAL
+        if now >= abort_due:
+            if monitor.waitForAbort(0.01):
+                stopped = True
+            abort_due = time.monotonic() + CORE_MAX_WAIT
+
+    fan.close()
+    emergency_fan.clear()
+    if subscriber is not None:
+        argonthermal_close(subscriber)
+        thermal_event_active.clear()
+    argonpush_close(pushsock)
+    status_clear(status_state)
+    if request is not None:
+        request.release()
+    sel.close()
+    sensor_executor.shutdown(wait=False)
+    i2c_executor.shutdown(wait=False)
+    with core_lock:
+        fds = core_pipe
+        core_pipe = None
+    os.close(fds[0])
+    os.close(fds[1])
+    return button_thread
+
+
+def replay(fname):
+    """
+    Replay a recorded temperature trace through fan_control on a virtual clock and return
+    the report. The fan curves are taken from the add-on settings, see argonreplay.py for
+    the trace formats. The thermal watchdog isn't part of the replay.
+    """
+    try:
+        samples = argonreplay_load(fname)
+    except (OSError, ValueError) as ex:
+        return 'Trace ' + fname + ' not readable: ' + str(ex)
+    if len(samples) < 2:
+        return 'No temperature samples found in ' + fname
+    report = argonreplay_report(argonreplay_run(sys.modules[__name__], samples))
+    xbmc.log(msg='Argon ONE Control: replay of ' + fname + '\n' + report, level=xbmc.LOGINFO)
+    return report
+
+
+def provision(i2c_missing):
+    """Copy the remote control and shutdown files and notify the GUI about the add-on start"""
+    global addon_count
+    starttime = time.monotonic()
+    __addon__ = xbmcaddon.Addon()
+    __addonname__ = __addon__.getAddonInfo('name')
+    __icon__ = __addon__.getAddonInfo('icon')
+
+    load_manifest()
+    if i2c_missing:
+        checksetup()
+        # Send message to GUI about reboot required
+        msg_line = "I2C not enabled yet. Fan control requires a reboot."
+        msg_time = 15000 #in miliseconds
+        xbmc.executebuiltin('Notification(%s, %s, %d, %s)'%(__addonname__, msg_line, msg_time, __icon__))
+    else:
+        # Respect user-specific remote control settings
+        lockfile = '/storage/.config/argon40_rc.lock'
+        if not os.path.exists(lockfile):
+            copykeymapfile()
+            mergercmapsfile()
+            removelircfile()
+        copyshutdownscript()
+
+        # Send message to GUI about add-on start
+        msg_line = "Fan control/power button event monitoring has started."
+        msg_time = 5000 #in miliseconds
+        xbmc.executebuiltin('Notification(%s, %s, %d, %s)'%(__addonname__, msg_line, msg_time, __icon__))
+        addon_count = addon_count + 1
+        xbmc.log(msg='Argon ONE Control: Add-on started. ' + str(addon_count), level=xbmc.LOGDEBUG)
+    save_manifest()
+    xbmc.log(msg='Argon ONE Control: file provisioning took {:.0f} ms'.format((time.monotonic()-starttime)*1000), level=xbmc.LOGDEBUG)
+
+
+xbmc.log(msg='Argon ONE Control: module import took {:.0f} ms'.format((time.monotonic()-startup_time)*1000), level=xbmc.LOGDEBUG)
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+#
+# Power button gesture decoder
+#
+# The Argon ONE MCU decodes the button itself and sends a pulse to the shutdown
+# pin: 20-30ms for a double tap, 40-50ms for a hold of 3 seconds. Longer pulses
+# come from a push button wired to the pin directly, these are counted as taps
+# or taken as a hold. The decoder only works on the edge timestamps, each edge
+# and each expiry check takes constant time.
+#
+
+# Pulse widths in milliseconds, the MCU double tap ends at the midpoint to the hold pulse
+ARGONBUTTON_NOISE = 10
+ARGONBUTTON_MCU_DOUBLE = 35
+ARGONBUTTON_MCU_HOLD = 55
+ARGONBUTTON_HOLD = 1500
+# Maximum time in milliseconds between the taps of one gesture
+ARGONBUTTON_TAP_GAP = 400
+
+ARGONBUTTON_GESTURES = ['single', 'double', 'triple', 'hold']
+
+
+def argonbutton_newstate():
+    return {"pressed": None, "taps": 0, "deadline": None}
+
+
+def argonbutton_reset(state):
+    state["taps"] = 0
+    state["deadline"] = None
+
+
+def argonbutton_expire(state, timestamp_ns):
+    # Gesture of the counted taps, once no further tap can follow
+    if state["deadline"] is None or state["pressed"] is not None or timestamp_ns < state["deadline"]:
+        return None
+    gesture = ARGONBUTTON_GESTURES[state["taps"]-1]
+    argonbutton_reset(state)
+    return gesture
+
+
+def argonbutton_edge(state, rising, timestamp_ns):
+    # Feed one edge of the shutdown pin, returns the decoded gesture or None
+    if rising:
+        gesture = argonbutton_expire(state, timestamp_ns)
+        state["pressed"] = timestamp_ns
+        return gesture
+    if state["pressed"] is None:
+        return None
+    width = (timestamp_ns - state["pressed"]) / 1000000
+    state["pressed"] = None
+    if width < ARGONBUTTON_NOISE:
+        return None
+    if width <= ARGONBUTTON_MCU_DOUBLE:
+        argonbutton_reset(state)
+        return "double"
+    if width <= ARGONBUTTON_MCU_HOLD or width >= ARGONBUTTON_HOLD:
+        argonbutton_reset(state)
+        return "hold"
+    state["taps"] = state["taps"] + 1
+    if state["taps"] >= 3:
+        argonbutton_reset(state)
+        return "triple"
+    state["deadline"] = timestamp_ns + ARGONBUTTON_TAP_GAP*1000000
+    return None
+
+
+def argonbutton_timeout(state, timestamp_ns):
+    # Seconds until argonbutton_expire has to be called, None without pending taps
+    if state["deadline"] is None or state["pressed"] is not None:
+        return None
+    return max(0, (state["deadline"] - timestamp_ns) / 1000000000)
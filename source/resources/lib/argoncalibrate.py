@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+#
+# Fan calibration helper methods
+#
+# The step tests hold each duty level of ARGONCALIBRATE_LEVELS while sampling
+# the CPU temperature. A first-order model dT/dt = (Tss - T) / tau is fitted to
+# the samples of each step, the steady state temperatures Tss per duty level
+# give the proposed fan curve.
+#
+
+# Duty levels of the step tests, from full speed down to off
+ARGONCALIBRATE_LEVELS = [100, 75, 50, 30, 10, 0]
+# Seconds each duty level is held and the sample interval
+ARGONCALIBRATE_HOLD = 180
+ARGONCALIBRATE_SAMPLE = 1
+# The steady state temperature has to stay this far below the target
+ARGONCALIBRATE_MARGIN = 3
+
+
+def argoncalibrate_fit(samples):
+    # Fit the model to (seconds, temperature) samples, returns (Tss, tau)
+    # The slope between two samples is regressed against the temperature:
+    # dT/dt = -T/tau + Tss/tau, which also works with irregular sample times.
+    points = []
+    for idx in range(len(samples) - 1):
+        dt = samples[idx + 1][0] - samples[idx][0]
+        if dt <= 0:
+            continue
+        points.append((samples[idx][1], (samples[idx + 1][1] - samples[idx][1]) / dt))
+    tail = [sample[1] for sample in samples[len(samples)*3//4:]]
+    fallback = sum(tail) / len(tail) if len(tail) > 0 else None
+    if len(points) < 3:
+        return (fallback, None)
+    meantemp = sum(point[0] for point in points) / len(points)
+    meanslope = sum(point[1] for point in points) / len(points)
+    sxx = sum((point[0] - meantemp) ** 2 for point in points)
+    if sxx <= 0:
+        return (fallback, None)
+    m = sum((point[0] - meantemp) * (point[1] - meanslope) for point in points) / sxx
+    if m >= 0:
+        return (fallback, None)
+    c = meanslope - m * meantemp
+    return (-c / m, -1 / m)
+
+
+def argoncalibrate_steadytemp(steadystates, duty):
+    # Steady state temperature of a duty level, interpolated between the measured levels
+    levels = sorted(steadystates)
+    if duty <= levels[0]:
+        return steadystates[levels[0]]
+    for idx in range(len(levels) - 1):
+        if levels[idx] <= duty <= levels[idx + 1]:
+            share = (duty - levels[idx]) / (levels[idx + 1] - levels[idx])
+            return steadystates[levels[idx]] + share * (steadystates[levels[idx + 1]] - steadystates[levels[idx]])
+    return steadystates[levels[-1]]
+
+
+def argoncalibrate_curve(steadystates, target):
+    # Propose three (temperature, speed) pairs from the steady state temperatures per duty level.
+    # The lowest duty which keeps the steady state below the target is the first fan speed, it is
+    # switched on below that steady state, so the fan keeps running at that speed instead of
+    # toggling. Full speed is left as reserve right below the target.
+    need = 100
+    for duty in sorted(steadystates):
+        if steadystates[duty] <= target - ARGONCALIBRATE_MARGIN:
+            need = duty
+            break
+    speed_a = min(100, max(10, ((need + 4) // 5) * 5))
+    if need == 0:
+        # No fan needed at the calibration load, start once it gets warmer
+        temp_a = int(steadystates[0]) + 1
+    else:
+        temp_a = int(argoncalibrate_steadytemp(steadystates, speed_a)) - 1
+    temp_c = int(target) - 1
+    temp_a = max(20, min(temp_a, temp_c - 2))
+    temp_b = max(temp_a + 1, (temp_a + temp_c) // 2)
+    speed_b = min(100, max(speed_a, ((speed_a + 100) // 10) * 5))
+    return [(temp_a, speed_a), (temp_b, speed_b), (temp_c, 100)]
@@ -0,0 +1,305 @@
+#!/usr/bin/python3
+
+#
+# Headless host helper methods
+#
+# Provides the part of the Kodi API which argon.py and service.py use, so the
+# fan and power button engine also runs as a standalone daemon without Kodi,
+# see daemon.py. The settings are the defaults of resources/settings.xml,
+# overridden by the add-on settings saved by Kodi and by the [settings]
+# section of the INI file. Changed files are reloaded like a settings change
+# in Kodi. Settings changed by the engine, i.e. the fan calibration results,
+# are saved to a state file next to the INI file. A saved value replaces the
+# one of Kodi or the INI file only as long as that one stays unchanged, so the
+# later changes in Kodi win. The log goes to syslog.
+#
+import configparser
+import os
+import subprocess
+import syslog
+import threading
+import time
+import types
+import xml.etree.ElementTree as ET
+
+ARGONHEADLESS_ADDON_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ARGONHEADLESS_DEFAULTS = os.path.join(ARGONHEADLESS_ADDON_DIR, 'resources', 'settings.xml')
+ARGONHEADLESS_KODI_SETTINGS = '/storage/.kodi/userdata/addon_data/service.argononecontrol/settings.xml'
+ARGONHEADLESS_CONFIG = '/storage/.config/argononecontrol.ini'
+# Seconds between the checks for changed settings files
+ARGONHEADLESS_RELOAD_INTERVAL = 5
+
+# Log levels of the Kodi API
+LOGDEBUG = 0
+LOGINFO = 1
+LOGWARNING = 2
+LOGERROR = 3
+LOGFATAL = 4
+LOGNONE = 5
+ARGONHEADLESS_PRIORITIES = {
+    LOGDEBUG: syslog.LOG_DEBUG,
+    LOGINFO: syslog.LOG_INFO,
+    LOGWARNING: syslog.LOG_WARNING,
+    LOGERROR: syslog.LOG_ERR,
+    LOGFATAL: syslog.LOG_CRIT,
+}
+
+# System commands of the Kodi builtins, which the power button gestures may run
+ARGONHEADLESS_BUILTINS = {
+    'shutdown': ['systemctl', 'poweroff'],
+    'powerdown': ['systemctl', 'poweroff'],
+    'reboot': ['systemctl', 'reboot'],
+    'restart': ['systemctl', 'reboot'],
+    'restartapp': ['systemctl', 'restart', 'kodi'],
+}
+
+argonheadless_state = {
+    "config": ARGONHEADLESS_CONFIG,
+    "statefile": os.path.splitext(ARGONHEADLESS_CONFIG)[0] + '.state',
+    "settings": {},
+    "configured": {},
+    "units": '°C',
+    "debug": False,
+    "mtimes": None,
+    "checked": 0,
+    "monitors": [],
+    "abort": threading.Event(),
+}
+
+
+def argonheadless_readsettings(fname, settings):
+    # Setting values of an add-on settings.xml, the defaults of resources/settings.xml
+    # or the values saved by Kodi (version 2, or version 1 with value attributes)
+    try:
+        root = ET.parse(fname).getroot()
+    except (OSError, ET.ParseError):
+        return
+    for child in root.iter('setting'):
+        settingid = child.get('id')
+        if settingid is None:
+            continue
+        if child.find('default') is not None:
+            settings[settingid] = child.find('default').text or ''
+        elif child.get('value') is not None:
+            settings[settingid] = child.get('value')
+        elif child.get('default') != 'true':
+            settings[settingid] = child.text or ''
+
+
+def argonheadless_readstate(fname):
+    state = configparser.ConfigParser(interpolation=None)
+    try:
+        state.read(fname, encoding='utf-8')
+    except configparser.Error as err:
+        argonheadless_log('Argon ONE Control: ' + fname + ' not loaded : ' + str(err), LOGWARNING)
+        state = configparser.ConfigParser(interpolation=None)
+    for section in ['settings', 'replaced']:
+        if not state.has_section(section):
+            state.add_section(section)
+    return state
+
+
+def argonheadless_writestate(fname, state):
+    # Replaced at once, a reload never sees a partly written file
+    tmpfile = fname + '.tmp'
+    with open(tmpfile, 'w', encoding='utf-8') as fp:
+        state.write(fp)
+    os.replace(tmpfile, fname)
+
+
+def argonheadless_mtimes():
+    mtimes = []
+    for fname in [ARGONHEADLESS_KODI_SETTINGS, argonheadless_state["config"], argonheadless_state["statefile"]]:
+        try:
+            mtimes.append(os.stat(fname).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def argonheadless_load():
+    argonheadless_state["mtimes"] = argonheadless_mtimes()
+    # Values of Kodi and the INI file, the INI file wins
+    configured = {}
+    argonheadless_readsettings(ARGONHEADLESS_KODI_SETTINGS, configured)
+    config = configparser.ConfigParser(interpolation=None)
+    try:
+        config.read(argonheadless_state["config"], encoding='utf-8')
+    except configparser.Error as err:
+        argonheadless_log('Argon ONE Control: ' + argonheadless_state["config"] + ' not loaded : ' + str(err), LOGWARNING)
+    if config.has_section('settings'):
+        for name, value in config.items('settings'):
+            configured[name] = value
+
+    # Saved values of the engine, dropped once Kodi or the INI file changed the setting
+    state = argonheadless_readstate(argonheadless_state["statefile"])
+    outdated = []
+    for name in state.options('settings'):
+        if configured.get(name) != state.get('replaced', name, fallback=None):
+            outdated.append(name)
+    if len(outdated) > 0:
+        for name in outdated:
+            state.remove_option('settings', name)
+            state.remove_option('replaced', name)
+        try:
+            argonheadless_writestate(argonheadless_state["statefile"], state)
+        except OSError as err:
+            argonheadless_log('Argon ONE Control: ' + argonheadless_state["statefile"] + ' not saved : ' + str(err), LOGWARNING)
+        argonheadless_state["mtimes"][2] = argonheadless_mtimes()[2]
+
+    settings = {}
+    argonheadless_readsettings(ARGONHEADLESS_DEFAULTS, settings)
+    settings.update(configured)
+    for name in state.options('settings'):
+        settings[name] = state.get('settings', name)
+    argonheadless_state["settings"] = settings
+    argonheadless_state["configured"] = configured
+    argonheadless_state["units"] = '°F' if config.get('daemon', 'temperature_units', fallback='C').strip().upper() in ['F', '°F'] else '°C'
+    argonheadless_state["debug"] = config.getboolean('daemon', 'debug', fallback=False)
+
+
+def argonheadless_savesetting(name, value):
+    # Save name to the state file, with the value of Kodi or the INI file it replaces
+    fname = argonheadless_state["statefile"]
+    state = argonheadless_readstate(fname)
+    state.set('settings', name, value)
+    if name in argonheadless_state["configured"]:
+        state.set('replaced', name, argonheadless_state["configured"][name])
+    else:
+        state.remove_option('replaced', name)
+    argonheadless_writestate(fname, state)
+
+
+def argonheadless_start(config):
+    # Load the settings of the config file and open the log
+    syslog.openlog('argononecontrol', syslog.LOG_PID, syslog.LOG_DAEMON)
+    argonheadless_state["config"] = config
+    argonheadless_state["statefile"] = os.path.splitext(config)[0] + '.state'
+    argonheadless_load()
+    argonheadless_log('Argon ONE Control: headless daemon, config file ' + config, LOGINFO)
+
+
+def argonheadless_checksettings():
+    # Reload changed settings files and notify the monitors, like Kodi does
+    now = time.monotonic()
+    if now - argonheadless_state["checked"] < ARGONHEADLESS_RELOAD_INTERVAL:
+        return
+    argonheadless_state["checked"] = now
+    if argonheadless_mtimes() == argonheadless_state["mtimes"]:
+        return
+    argonheadless_log('Argon ONE Control: settings reloaded', LOGINFO)
+    argonheadless_load()
+    for monitor in argonheadless_state["monitors"]:
+        monitor.onSettingsChanged()
+
+
+def argonheadless_reload():
+    # Reload at the next check, i.e. on SIGHUP
+    argonheadless_state["mtimes"] = None
+    argonheadless_state["checked"] = 0
+
+
+def argonheadless_log(msg, level=LOGDEBUG):
+    if level == LOGDEBUG and not argonheadless_state["debug"]:
+        return
+    if level in ARGONHEADLESS_PRIORITIES:
+        syslog.syslog(ARGONHEADLESS_PRIORITIES[level], msg)
+
+
+def argonheadless_executebuiltin(action, wait=False):
+    name = action.split('(')[0].strip().lower()
+    if name == 'notification':
+        argonheadless_log('Argon ONE Control: ' + action, LOGINFO)
+    elif name in ARGONHEADLESS_BUILTINS:
+        argonheadless_log('Argon ONE Control: running ' + ' '.join(ARGONHEADLESS_BUILTINS[name]), LOGINFO)
+        subprocess.Popen(ARGONHEADLESS_BUILTINS[name], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        argonheadless_log('Argon ONE Control: ' + action + ' not available without Kodi', LOGWARNING)
+
+
+def argonheadless_getinfolabel(label):
+    if label == 'System.TemperatureUnits':
+        return argonheadless_state["units"]
+    return ''
+
+
+class ArgonHeadlessMonitor:
+    def __init__(self):
+        argonheadless_state["monitors"].append(self)
+
+    def onSettingsChanged(self):
+        pass
+
+    def abortRequested(self):
+        return argonheadless_state["abort"].is_set()
+
+    def waitForAbort(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            argonheadless_checksettings()
+            remaining = ARGONHEADLESS_RELOAD_INTERVAL
+            if deadline is not None:
+                remaining = min(remaining, deadline - time.monotonic())
+            if argonheadless_state["abort"].wait(max(0, remaining)):
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+
+class ArgonHeadlessPlayer:
+    # Nothing plays without Kodi, the playback callbacks are never called
+    def __init__(self):
+        pass
+
+    def isPlayingVideo(self):
+        return False
+
+
+class ArgonHeadlessAddon:
+    def __init__(self, id=None):
+        self.settings = argonheadless_state["settings"]
+
+    def getSetting(self, name):
+        return self.settings.get(name, '')
+
+    def getSettingBool(self, name):
+        return self.getSetting(name).strip().lower() == 'true'
+
+    def getSettingInt(self, name):
+        try:
+            return int(float(self.getSetting(name)))
+        except ValueError:
+            return 0
+
+    # Saved to the state file, which is reloaded as a settings change like Kodi does
+    def setSetting(self, name, value):
+        self.settings[name] = value
+        try:
+            argonheadless_savesetting(name, value)
+        except OSError as err:
+            argonheadless_log('Argon ONE Control: ' + name + ' not saved to ' + argonheadless_state["statefile"] + ' : ' + str(err), LOGWARNING)
+
+    def setSettingBool(self, name, value):
+        self.setSetting(name, 'true' if value else 'false')
+
+    def setSettingInt(self, name, value):
+        self.setSetting(name, str(value))
+
+    def getAddonInfo(self, name):
+        return {
+            "id": 'service.argononecontrol',
+            "name": 'Argon ONE Control',
+            "icon": '',
+            "path": ARGONHEADLESS_ADDON_DIR,
+        }.get(name, '')
+
+
+# Stand-ins for the Kodi modules
+xbmc = types.SimpleNamespace(
+    LOGDEBUG=LOGDEBUG, LOGINFO=LOGINFO, LOGWARNING=LOGWARNING, LOGERROR=LOGERROR, LOGFATAL=LOGFATAL, LOGNONE=LOGNONE,
+    log=argonheadless_log,
+    executebuiltin=argonheadless_executebuiltin,
+    getInfoLabel=argonheadless_getinfolabel,
+    Monitor=ArgonHeadlessMonitor,
+    Player=ArgonHeadlessPlayer)
+xbmcaddon = types.SimpleNamespace(Addon=ArgonHeadlessAddon)
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+#
+# Temperature push helper methods
+#
+# Other processes push named temperature readings to a UNIX datagram socket,
+# one reading per line: "<name> <temperature in °C> [<TTL in seconds>]", e.g.
+#   echo "ambient 31.5 120" | socat - UNIX-SENDTO:/run/argononecontrol.sock
+# A reading is valid until its TTL has passed, ARGONPUSH_TTL without TTL.
+#
+import os
+import select
+import socket
+import time
+
+ARGONPUSH_SOCKET = '/run/argononecontrol.sock'
+# Seconds a reading without TTL stays valid, and the longest TTL accepted
+ARGONPUSH_TTL = 60
+ARGONPUSH_MAX_TTL = 3600
+# Temperatures outside of this range are dropped as invalid
+ARGONPUSH_MIN_TEMP = -40
+ARGONPUSH_MAX_TEMP = 150
+# Seconds until a failed open is retried, doubled per failure up to the maximum
+ARGONPUSH_RETRY = 5
+ARGONPUSH_RETRY_MAX = 300
+
+
+def argonpush_inuse(path):
+    # True if another process still receives on the socket
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def argonpush_open(path=ARGONPUSH_SOCKET):
+    try:
+        if os.path.exists(path):
+            if argonpush_inuse(path):
+                return None
+            # Left over by a previous run
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.bind(path)
+        # Any local process may push
+        os.chmod(path, 0o666)
+        return sock
+    except OSError:
+        return None
+
+
+def argonpush_retry(retrystate, now):
+    # Schedule the next open after a failed one, returns the delay
+    delay = min(retrystate.get('delay', ARGONPUSH_RETRY / 2) * 2, ARGONPUSH_RETRY_MAX)
+    retrystate['delay'] = delay
+    retrystate['due'] = now + delay
+    return delay
+
+
+def argonpush_close(sock, path=ARGONPUSH_SOCKET):
+    if sock is None:
+        return
+    sock.close()
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def argonpush_parse(data, now):
+    # Returns the valid readings of one datagram as (name, temperature, expiry)
+    readings = []
+    for curline in data.decode('utf-8', 'replace').splitlines():
+        fields = curline.split()
+        if len(fields) < 2 or len(fields) > 3:
+            continue
+        try:
+            temp = float(fields[1])
+            ttl = float(fields[2]) if len(fields) > 2 else ARGONPUSH_TTL
+        except ValueError:
+            continue
+        if temp != temp or temp < ARGONPUSH_MIN_TEMP or temp > ARGONPUSH_MAX_TEMP or ttl <= 0:
+            continue
+        readings.append((fields[0], temp, now + min(ttl, ARGONPUSH_MAX_TTL)))
+    return readings
+
+
+def argonpush_read(sock, timeout, wakefd=None):
+    readings = []
+    waitlist = [sock]
+    if wakefd is not None:
+        waitlist.append(wakefd)
+    readable = select.select(waitlist, [], [], timeout)[0]
+    if sock not in readable:
+        return readings
+    while True:
+        try:
+            data = sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            break
+        readings.extend(argonpush_parse(data, time.monotonic()))
+    return readings
+
+
+def argonpush_store(store, readings, now):
+    # Keep the newest reading per name, expired readings are dropped
+    for name, temp, expiry in readings:
+        store[name] = (temp, expiry)
+    for name in [name for name in store if store[name][1] <= now]:
+        del store[name]
+
+
+def argonpush_get(store, name, now):
+    if name not in store:
+        raise ValueError(name + ' not pushed')
+    temp, expiry = store[name]
+    if expiry <= now:
+        del store[name]
+        raise ValueError(name + ' expired')
+    return temp
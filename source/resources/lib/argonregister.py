@@ -5,7 +5,7 @@
 #
 import os
 import sys
-import time
+import threading
 
 if os.path.exists('/storage/.kodi/addons/virtual.system-tools/lib'):
     sys.path.append('/storage/.kodi/addons/virtual.system-tools/lib')
@@ -23,55 +23,61 @@ except ImportError:
 ADDR_ARGONONEFAN=0x1a
 ADDR_ARGONONEREG=ADDR_ARGONONEFAN
 
+# I2C bus numbers, tried in this order
+ARGONREGISTER_BUSES = [1, 0]
+
 # ARGONONEREG Addresses
 ADDR_ARGONONEREG_DUTYCYCLE=0x80
 ADDR_ARGONONEREG_FW=0x81
 ADDR_ARGONONEREG_IR=0x82
 ADDR_ARGONONEREG_CTRL=0x86
 
-# Initialize bus
-def argonregister_initializebusobj():
-    try:
-        return smbus.SMBus(1)
-    except Exception:
+# Set to cut the settle delays after the I2C writes short, i.e. on service stop
+argonregister_abort = threading.Event()
+
+# Initialize bus, the given bus number or the first available one
+def argonregister_initializebusobj(busnum=None):
+    # Bus 0 on older versions
+    for curbus in (ARGONREGISTER_BUSES if busnum is None else [busnum]):
         try:
-            # Older version
-            return smbus.SMBus(0)
+            return smbus.SMBus(curbus)
         except Exception:
-            print('Unable to detect i2c')
-            return None
+            continue
+    if busnum is None:
+        print('Unable to detect i2c')
+    return None
 
 
 # Checks if the FW supports control registers
-def argonregister_checksupport(busobj):
+def argonregister_checksupport(busobj, devaddr=ADDR_ARGONONEREG):
     if busobj is None:
         return False
     try:
-        oldval = argonregister_getbyte(busobj, ADDR_ARGONONEREG_DUTYCYCLE)
+        oldval = argonregister_getbyte(busobj, ADDR_ARGONONEREG_DUTYCYCLE, devaddr)
         newval = oldval + 1
         if newval >= 100:
             newval = 98
-        argonregister_setbyte(busobj, ADDR_ARGONONEREG_DUTYCYCLE, newval)
-        newval = argonregister_getbyte(busobj, ADDR_ARGONONEREG_DUTYCYCLE)
+        argonregister_setbyte(busobj, ADDR_ARGONONEREG_DUTYCYCLE, newval, devaddr)
+        newval = argonregister_getbyte(busobj, ADDR_ARGONONEREG_DUTYCYCLE, devaddr)
         return newval != oldval
     except:
         return False
 
 
-def argonregister_getbyte(busobj, address):
+def argonregister_getbyte(busobj, address, devaddr=ADDR_ARGONONEREG):
     if busobj is None:
         return 0
-    return busobj.read_byte_data(ADDR_ARGONONEREG, address)
+    return busobj.read_byte_data(devaddr, address)
 
 
-def argonregister_setbyte(busobj, address, bytevalue):
+def argonregister_setbyte(busobj, address, bytevalue, devaddr=ADDR_ARGONONEREG):
     if busobj is None:
         return
-    busobj.write_byte_data(ADDR_ARGONONEREG,address,bytevalue)
-    time.sleep(1)
+    busobj.write_byte_data(devaddr,address,bytevalue)
+    argonregister_abort.wait(1)
 
 
-def argonregister_setfanspeed(busobj, newspeed, regsupport=None):
+def argonregister_setfanspeed(busobj, newspeed, regsupport=None, devaddr=ADDR_ARGONONEFAN):
     if busobj is None:
         return
 
@@ -81,14 +87,14 @@ def argonregister_setfanspeed(busobj, newspeed, regsupport=None):
         newspeed = 0
     usereg = False
     if regsupport is None:
-        usereg=argonregister_checksupport(busobj)
+        usereg=argonregister_checksupport(busobj, devaddr)
     else:
         usereg=regsupport
     if usereg:
-        argonregister_setbyte(busobj, ADDR_ARGONONEREG_DUTYCYCLE, newspeed)
+        argonregister_setbyte(busobj, ADDR_ARGONONEREG_DUTYCYCLE, newspeed, devaddr)
     else:
-        busobj.write_byte(ADDR_ARGONONEFAN,newspeed)
-        time.sleep(1)
+        busobj.write_byte(devaddr,newspeed)
+        argonregister_abort.wait(1)
 
 
 def argonregister_signalpoweroff(busobj, regsupport=None):
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+#
+# Fan policy replay helper methods
+#
+# Replays a recorded temperature trace through the fan control of argon.py on
+# a virtual clock, without touching the sensors or the I2C bus. A trace is a
+# list of (seconds, {sensor name: value}) samples, loaded from a CSV file with
+# a "time" column and one column per sensor (CPU, GPU, SSD/NVMe, PMIC or the
+# name of an additional sensor, optional load in percent, throttled, freqratio), or from the
+# "current ... temperature" lines of a Kodi debug log.
+#
+import csv
+import datetime
+import re
+import threading
+import time
+import types
+
+# Trace columns which aren't temperature sensors
+ARGONREPLAY_SIGNALS = ['load', 'throttled', 'freqratio']
+ARGONREPLAY_LOGLINE = re.compile(r'^(\d{4}-\d{2}-\d{2} )?(\d{2}):(\d{2}):(\d{2})\.(\d{3}) .*Argon ONE Control: current (.+) temperature : (-?[0-9.]+)')
+
+
+def argonreplay_parsetime(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value.strip()).timestamp()
+
+
+def argonreplay_loadcsv(fname):
+    samples = []
+    with open(fname, 'r', newline='') as fp:
+        for row in csv.DictReader(fp):
+            try:
+                curtime = argonreplay_parsetime(row.pop('time'))
+            except (KeyError, TypeError, ValueError):
+                continue
+            values = {}
+            for name in row:
+                try:
+                    values[name.strip()] = float(row[name])
+                except (TypeError, ValueError):
+                    continue
+            samples.append((curtime, values))
+    samples.sort(key=lambda sample: sample[0])
+    return samples
+
+
+def argonreplay_loadlog(fname):
+    samples = []
+    values = {}
+    dayoffset = 0
+    prevtime = None
+    with open(fname, 'r', errors='replace') as fp:
+        for curline in fp:
+            match = ARGONREPLAY_LOGLINE.match(curline)
+            if match is None:
+                continue
+            curtime = int(match.group(2))*3600 + int(match.group(3))*60 + int(match.group(4)) + int(match.group(5))/1000
+            if match.group(1) is not None:
+                curtime = curtime + datetime.datetime.strptime(match.group(1).strip(), '%Y-%m-%d').timestamp()
+            elif prevtime is not None and curtime + dayoffset < prevtime:
+                # Without date the time of day wraps around at midnight
+                dayoffset = dayoffset + 86400
+            curtime = curtime + dayoffset
+            prevtime = curtime
+            values = dict(values)
+            values[match.group(6)] = float(match.group(7))
+            if len(samples) > 0 and samples[-1][0] == curtime:
+                samples[-1] = (curtime, values)
+            else:
+                samples.append((curtime, values))
+    return samples
+
+
+def argonreplay_load(fname):
+    if fname.lower().endswith('.csv'):
+        return argonreplay_loadcsv(fname)
+    return argonreplay_loadlog(fname)
+
+
+def argonreplay_run(argonmod, samples):
+    # Drive argonmod.fan_control over the samples, returns the statistics
+    state = {"now": samples[0][0], "idx": 0, "writes": []}
+    hooks = {}
+
+    def curvalue(name, default=None):
+        while state["idx"] + 1 < len(samples) and samples[state["idx"] + 1][0] <= state["now"]:
+            state["idx"] = state["idx"] + 1
+        value = samples[state["idx"]][1].get(name, default)
+        if value is None:
+            raise ValueError(name + ' not in trace')
+        return value
+
+    def setfanspeed(bus, newspeed, regsupport, devaddr=None):
+        state["writes"].append((state["now"], newspeed))
+
+    def getcpuload(loadstate):
+        load = curvalue('load', -1)
+        if load < 0:
+            return None
+        return load/100
+
+    clock = types.SimpleNamespace(
+        monotonic=lambda: argonmod.startup_time + state["now"] - samples[0][0],
+        monotonic_ns=lambda: int((argonmod.startup_time + state["now"] - samples[0][0])*1000000000),
+        sleep=lambda sec: None)
+    hooks["time"] = clock
+    hooks["argonsysinfo_getcputemp"] = lambda: curvalue('CPU')
+    hooks["argonsysinfo_getgputemp"] = lambda: curvalue('GPU')
+    hooks["argonsysinfo_getmaxhddtemp"] = lambda: curvalue('SSD/NVMe')
+    hooks["argonsysinfo_getpmictemp"] = lambda: curvalue('PMIC')
+    hooks["argonsysinfo_getsensortemp"] = curvalue
+    hooks["argonsysinfo_listthermalsensors"] = lambda: [name for name in sorted(samples[0][1]) if name not in ARGONREPLAY_SIGNALS]
+    hooks["argonsysinfo_getthrottled"] = lambda: int(curvalue('throttled', 0))
+    hooks["argonsysinfo_getcpufreqratio"] = lambda: curvalue('freqratio', 0)
+    hooks["argonsysinfo_getcpuload"] = getcpuload
+    hooks["argonregister_checksupport"] = lambda bus, devaddr=None: True
+    # Only the Argon ONE fan, the additional fan controllers stay without bus
+    hooks["argonregister_initializebusobj"] = lambda busnum=None: None
+    hooks["argonregister_setfanspeed"] = setfanspeed
+    # The step tests would write the settings
+    hooks["fan_calibration"] = lambda abort_flag, i2c_executor=None: iter(())
+
+    saved = {}
+    for name in hooks:
+        saved[name] = getattr(argonmod, name)
+        setattr(argonmod, name, hooks[name])
+    starttime = time.monotonic()
+    try:
+        fan = argonmod.fan_control(threading.Event(), None)
+        endtime = samples[-1][0]
+        while state["now"] < endtime:
+            state["now"] = state["now"] + next(fan)
+        fan.close()
+    finally:
+        for name in saved:
+            setattr(argonmod, name, saved[name])
+    return argonreplay_stats(samples, state["writes"], argonmod.cpu_thresholds, time.monotonic() - starttime)
+
+
+def argonreplay_stats(samples, writes, thresholds, runtime):
+    duration = samples[-1][0] - samples[0][0]
+    above = {}
+    for threshold in thresholds:
+        above[threshold] = 0
+    for idx in range(len(samples) - 1):
+        cputemp = samples[idx][1].get('CPU')
+        if cputemp is None:
+            continue
+        for threshold in thresholds:
+            if cputemp >= threshold:
+                above[threshold] = above[threshold] + samples[idx + 1][0] - samples[idx][0]
+
+    # Duty cycle over time and its changes, starting with the first write
+    dutytime = 0
+    changes = 0
+    churn = 0
+    for idx in range(len(writes)):
+        nexttime = writes[idx + 1][0] if idx + 1 < len(writes) else samples[-1][0]
+        dutytime = dutytime + writes[idx][1] * max(0, min(nexttime, samples[-1][0]) - writes[idx][0])
+        if idx > 0 and writes[idx][1] != writes[idx - 1][1]:
+            changes = changes + 1
+            churn = churn + abs(writes[idx][1] - writes[idx - 1][1])
+    return {
+        "duration": duration,
+        "samples": len(samples),
+        "writes": len(writes),
+        "changes": changes,
+        "churn": churn,
+        "meanduty": dutytime / duration if duration > 0 else 0,
+        "above": above,
+        "runtime": runtime,
+    }
+
+
+def argonreplay_report(stats):
+    hours = max(stats["duration"], 1) / 3600
+    lines = []
+    lines.append('Trace: ' + str(datetime.timedelta(seconds=int(stats["duration"]))) + ', ' + str(stats["samples"]) + ' samples')
+    lines.append('I2C writes: {} ({:.1f} per hour)'.format(stats["writes"], stats["writes"] / hours))
+    lines.append('Duty cycle churn: {} changes, {} % total change ({:.1f} % per hour)'.format(stats["changes"], stats["churn"], stats["churn"] / hours))
+    lines.append('Mean duty cycle: {:.1f} %'.format(stats["meanduty"]))
+    for threshold in sorted(stats["above"]):
+        lines.append('Time above {:.1f} °C: {} ({:.1f} %)'.format(threshold, str(datetime.timedelta(seconds=int(stats["above"][threshold]))), 100 * stats["above"][threshold] / max(stats["duration"], 1)))
+    lines.append('Replay took {:.2f} s'.format(stats["runtime"]))
+    return '\n'.join(lines)
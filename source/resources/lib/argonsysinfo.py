@@ -4,12 +4,53 @@
 # Misc methods to retrieve system information.
 #
 
+import concurrent.futures
+import glob
 import os
 import time
 import socket
+import subprocess
+import threading
 
 BIN_PATH = '/storage/.kodi/addons/virtual.system-tools/bin/'
 
+# Netlink protocol for kernel uevents (linux/netlink.h)
+NETLINK_KOBJECT_UEVENT = 15
+
+# Cached block device inventory, refreshed on hot-plug only
+blockdev_inventory = None
+blockdev_uevent = None
+blockdev_devmtime = 0
+
+# Disk temperature probes: worker pool, hard deadline per device (seconds)
+# and quarantine with exponential backoff for repeatedly failing devices
+HDDTEMP_WORKERS = 3
+HDDTEMP_TIMEOUT = 4
+HDDTEMP_QUARANTINE_FAILURES = 3
+HDDTEMP_BACKOFF = 60
+HDDTEMP_BACKOFF_MAX = 1800
+HDDTEMP_STALE_MAX = 600
+# Spinning disks change temperature slowly and must not be woken up
+HDDTEMP_ROTATIONAL_INTERVAL = 300
+HDDTEMP_STANDBY = -2
+hddtemp_executor = None
+hddtemp_state = {}
+
+# Running sensor commands, killed by argonsysinfo_cancelcommands()
+runcmd_procs = set()
+runcmd_lock = threading.Lock()
+runcmd_cancelled = threading.Event()
+
+# Held-open descriptors of the temperature sysfs files, path -> fd
+tempfd_list = {}
+tempfd_lock = threading.Lock()
+# Cached sensor list, rebuilt after THERMALSENSOR_TTL seconds and on a lookup
+# miss at most every THERMALSENSOR_MISS_INTERVAL seconds (hot-plugged sensors)
+THERMALSENSOR_TTL = 300
+THERMALSENSOR_MISS_INTERVAL = 30
+thermal_sensors = None
+thermal_sensors_time = 0
+
 def argonsysinfo_listcpuusage(sleepsec = 1):
 	outputlist = []
 	curusage_a = argonsysinfo_getcpuusagesnapshot()
@@ -65,6 +106,39 @@ def argonsysinfo_getcpuusagesnapshot():
 		errorflag = True
 	return cpupercent
 
+def argonsysinfo_getcpuload(loadstate):
+	# Busy share of all CPUs since the previous call, None on the first call
+	snapshot = argonsysinfo_getcpuusagesnapshot().get("cpu")
+	if snapshot is None:
+		return None
+	prevsnapshot = loadstate.get("cpu")
+	loadstate["cpu"] = snapshot
+	if prevsnapshot is None or snapshot["total"] <= prevsnapshot["total"]:
+		return None
+	total = snapshot["total"]-prevsnapshot["total"]
+	idle = snapshot["idle"]-prevsnapshot["idle"]
+	return (total-idle)/total
+
+
+def argonsysinfo_listcpuusagesince(usagestate):
+	# Usage per CPU and of all CPUs ("cpu") since the previous call, without blocking
+	outputlist = []
+	curusage = argonsysinfo_getcpuusagesnapshot()
+	prevusage = usagestate.get("snapshot")
+	usagestate["snapshot"] = curusage
+	if prevusage is None:
+		return outputlist
+	for cpuname in curusage:
+		if cpuname not in prevusage:
+			continue
+		total = curusage[cpuname]["total"]-prevusage[cpuname]["total"]
+		idle = curusage[cpuname]["idle"]-prevusage[cpuname]["idle"]
+		if total <= 0:
+			outputlist.append({"title": cpuname, "value": 0})
+		else:
+			outputlist.append({"title": cpuname, "value": int(100*(total-idle)/(total))})
+	return outputlist
+
 
 def argonsysinfo_liststoragetotal():
 	outputlist = []
@@ -130,39 +204,106 @@ def argonsysinfo_getram():
 	return [str(int(100*totalfree/totalram))+"%", str((totalram+512*1024)>>20)+"GB"]
 
 def argonsysinfo_getcputemp():
+	#cval = temp/1000
+	#fval = 32+9*temp/5000
+	return argonsysinfo_readtempfile("/sys/class/thermal/thermal_zone0/temp")
+
+def argonsysinfo_readtempfile(fname):
+	# Millidegree sysfs value, the file is kept open and re-read from offset 0
+	with tempfd_lock:
+		fd = tempfd_list.get(fname)
+		if fd is None:
+			try:
+				fd = os.open(fname, os.O_RDONLY)
+			except OSError:
+				return 0
+			tempfd_list[fname] = fd
 	try:
-		tempfp = open("/sys/class/thermal/thermal_zone0/temp", "r")
-		temp = tempfp.readline()
-		tempfp.close()
-		#cval = temp/1000
-		#fval = 32+9*temp/5000
-		return float(int(temp)/1000)
-	except IOError:
+		return float(int(os.pread(fd, 32, 0))/1000)
+	except (OSError, ValueError):
+		# Sensor gone (i.e. hot-unplugged NVMe), reopen on next read
+		with tempfd_lock:
+			if tempfd_list.get(fname) == fd:
+				del tempfd_list[fname]
+				os.close(fd)
 		return 0
 
-def argonsysinfo_getgputemp():
-	cmdstr = "/usr/bin/vcgencmd measure_temp | sed -e \"s/temp=//\" -e \"s/\.*'C/ /\""
-
-	tempval = 0
-	if len(cmdstr) > 0:
-		try:
-			temperaturestr = os.popen(cmdstr+" 2>&1").read()
-			tempval = float(temperaturestr)
-		except:
-			tempval = -1
+def argonsysinfo_listthermalsensors(maxage = THERMALSENSOR_TTL):
+	# All thermal zones and hwmon temperature inputs, name -> sysfs file
+	# Names: thermal zone type (i.e. cpu-thermal) or <hwmon name>/<label> (i.e. nvme/Composite)
+	global thermal_sensors, thermal_sensors_time
+	now = time.monotonic()
+	if thermal_sensors is not None and now - thermal_sensors_time < maxage:
+		return thermal_sensors
+	outputobj = {}
+	for zonepath in sorted(glob.glob("/sys/class/thermal/thermal_zone*")):
+		zonename = argonsysinfo_readsysfs(zonepath+"/type")
+		if zonename == "" or zonename in outputobj:
+			zonename = os.path.basename(zonepath)
+		outputobj[zonename] = zonepath+"/temp"
+	for inputfile in sorted(glob.glob("/sys/class/hwmon/hwmon*/temp*_input")):
+		hwmonpath = os.path.dirname(inputfile)
+		tempid = os.path.basename(inputfile)[0:-len("_input")]
+		label = argonsysinfo_readsysfs(hwmonpath+"/"+tempid+"_label", tempid)
+		sensorname = argonsysinfo_readsysfs(hwmonpath+"/name", os.path.basename(hwmonpath))+"/"+label
+		if sensorname in outputobj:
+			sensorname = os.path.basename(hwmonpath)+"/"+tempid
+		outputobj[sensorname] = inputfile
+	thermal_sensors = outputobj
+	thermal_sensors_time = now
+	return thermal_sensors
+
+def argonsysinfo_getsensortemp(sensorname):
+	# Temperature of a sensor from argonsysinfo_listthermalsensors()
+	# The sysfs name (i.e. thermal_zone1, hwmon2/temp1) is accepted as well
+	sensorlist = argonsysinfo_listthermalsensors()
+	if sensorname not in sensorlist:
+		# Possibly added since the list was built
+		sensorlist = argonsysinfo_listthermalsensors(THERMALSENSOR_MISS_INTERVAL)
+	if sensorname in sensorlist:
+		return argonsysinfo_readtempfile(sensorlist[sensorname])
+	if sensorname[0:12] == "thermal_zone":
+		return argonsysinfo_readtempfile("/sys/class/thermal/"+sensorname+"/temp")
+	if sensorname[0:5] == "hwmon" and sensorname.find("/") > 0:
+		return argonsysinfo_readtempfile("/sys/class/hwmon/"+sensorname+"_input")
+	return 0
+
+def argonsysinfo_getthrottled():
+	# Firmware throttle state (vcgencmd get_throttled), -1 if not exposed by the kernel
+	# Bit 0: under-voltage, 1: arm frequency capped, 2: throttled, 3: soft temperature limit active
+	# Bit 16-19: the same conditions have occurred since boot
+	temp = argonsysinfo_readsysfs("/sys/devices/platform/soc/soc:firmware/get_throttled")
+	try:
+		return int(temp, 16)
+	except ValueError:
+		return -1
+
+def argonsysinfo_getcpufreqratio():
+	# Highest current/maximum frequency ratio of all CPU cores, 0 if not available
+	maxratio = 0
+	for cpupath in glob.glob("/sys/devices/system/cpu/cpu[0-9]*/cpufreq"):
+		curfreq = argonsysinfo_readsysfs(cpupath+"/scaling_cur_freq", "0")
+		maxfreq = argonsysinfo_readsysfs(cpupath+"/scaling_max_freq", "0")
+		if not curfreq.isdigit() or not maxfreq.isdigit() or int(maxfreq) == 0:
+			continue
+		ratio = int(curfreq)/int(maxfreq)
+		if ratio > maxratio:
+			maxratio = ratio
+	return maxratio
 
-	return tempval
+def argonsysinfo_getgputemp():
+	return argonsysinfo_getvcgencmdtemp(["/usr/bin/vcgencmd", "measure_temp"])
 
 def argonsysinfo_getpmictemp():
-	cmdstr = "/usr/bin/vcgencmd measure_temp pmic | sed -e \"s/temp=//\" -e \"s/\.*'C/ /\""
+	return argonsysinfo_getvcgencmdtemp(["/usr/bin/vcgencmd", "measure_temp", "pmic"])
 
-	tempval = 0
-	if len(cmdstr) > 0:
-		try:
-			temperaturestr = os.popen(cmdstr+" 2>&1").read()
-			tempval = float(temperaturestr)
-		except:
-			tempval = -1
+def argonsysinfo_getvcgencmdtemp(cmdlist):
+	# Output: temp=48.3'C
+	temperaturestr = argonsysinfo_runcmd(cmdlist, 2)
+	try:
+		tempval = float(temperaturestr.strip().replace("temp=", "").replace("'C", ""))
+	except:
+		tempval = -1
 
 	return tempval
 
@@ -179,59 +320,261 @@ def argonsysinfo_getmaxhddtemp():
 
 def argonsysinfo_gethddtemp():
 	# May 2022: Used smartctl, hddtemp is not available on some platforms
+	global hddtemp_executor
 	hddtempcmd = BIN_PATH + "smartctl"
 	if os.path.exists(hddtempcmd) == False:
 		# Fallback for now
 		hddtempcmd = BIN_PATH + "hddtemp"
 
 	outputobj = {}
-	if os.path.exists(hddtempcmd):
+	pending = {}
+	now = time.monotonic()
+	try:
+		devlist = argonsysinfo_listblockdevices()
+		# Forget devices which were removed
+		for devname in list(hddtemp_state):
+			if devname not in [curdev["name"] for curdev in devlist]:
+				del hddtemp_state[devname]
+
+		for curdev in devlist:
+			devname = curdev["name"]
+			if devname not in hddtemp_state:
+				hddtemp_state[devname] = {"value": 0, "time": 0, "stale": False, "standby": False, "failures": 0, "retry": 0, "next": 0, "busy": False}
+			probestate = hddtemp_state[devname]
+			if probestate["next"] > now:
+				# Rotational media, polled at a longer interval
+				continue
+			if probestate["retry"] > now or probestate["busy"]:
+				# Quarantined or previous probe still hanging, use last good value
+				probestate["stale"] = True
+			elif curdev["hwmon"] != "":
+				# Kernel driver already exposes the temperature (nvme, drivetemp)
+				argonsysinfo_updatehddstate(devname, argonsysinfo_gethwmontemp(curdev["hwmon"]), now)
+			elif os.path.exists(hddtempcmd):
+				if hddtemp_executor is None:
+					hddtemp_executor = concurrent.futures.ThreadPoolExecutor(max_workers=HDDTEMP_WORKERS, thread_name_prefix="argonhddtemp")
+				probestate["busy"] = True
+				future = hddtemp_executor.submit(argonsysinfo_probehddtemp, hddtempcmd, curdev)
+				future.add_done_callback(lambda f, probestate=probestate: probestate.update(busy=False))
+				pending[future] = curdev
+
+		if len(pending) > 0:
+			done, notdone = concurrent.futures.wait(pending, timeout=HDDTEMP_TIMEOUT+1)
+			for future in pending:
+				tempval = -1
+				if future in done and future.exception() is None:
+					tempval = future.result()
+				curdev = pending[future]
+				argonsysinfo_updatehddstate(curdev["name"], tempval, now)
+				if curdev["rotational"] and hddtemp_state[curdev["name"]]["failures"] == 0:
+					hddtemp_state[curdev["name"]]["next"] = now + HDDTEMP_ROTATIONAL_INTERVAL
+
+		for devname in hddtemp_state:
+			probestate = hddtemp_state[devname]
+			if probestate["standby"]:
+				# Spun down disks are counted as cool
+				continue
+			if probestate["value"] > 0 and now-probestate["time"] <= HDDTEMP_STALE_MAX:
+				outputobj[devname] = probestate["value"]
+		return outputobj
+	except:
+		return outputobj
+
+def argonsysinfo_gethddtempstate():
+	# Per device probe state: last good value, stale and standby flag, failure count
+	return dict((devname, dict(hddtemp_state[devname])) for devname in hddtemp_state)
+
+def argonsysinfo_updatehddstate(devname, tempval, now):
+	probestate = hddtemp_state[devname]
+	if tempval == HDDTEMP_STANDBY:
+		probestate.update(stale=False, standby=True, failures=0, retry=0)
+		return
+	if tempval > 0:
+		probestate.update(value=tempval, time=now, stale=False, standby=False, failures=0, retry=0)
+		return
+	probestate["stale"] = True
+	probestate["standby"] = False
+	probestate["failures"] = probestate["failures"] + 1
+	if probestate["failures"] >= HDDTEMP_QUARANTINE_FAILURES:
+		backoff = HDDTEMP_BACKOFF * 2**(probestate["failures"]-HDDTEMP_QUARANTINE_FAILURES)
+		probestate["retry"] = now + min(backoff, HDDTEMP_BACKOFF_MAX)
+
+def argonsysinfo_probehddtemp(hddtempcmd, curdev):
+	if curdev["type"] == "nvme":
+		return argonsysinfo_getdevnvmetemp(hddtempcmd, curdev["name"])
+	return argonsysinfo_getdevhddtemp(hddtempcmd, curdev["name"])
+
+def argonsysinfo_runcmd(cmdlist, timeout = HDDTEMP_TIMEOUT):
+	# Run a command with a hard deadline, the process is killed when exceeded
+	with runcmd_lock:
+		if runcmd_cancelled.is_set():
+			return None
 		try:
-			tmp = os.popen("cat /proc/partitions | egrep \"sd|hd|nvme\" | awk '{print $4}' | egrep \"[^0-9]+$\"").read()
-			alllines = tmp.split("\n")
-			for curdev in alllines:
-				if curdev[0:2] == "sd" or curdev[0:2] == "hd":
-					tempval = argonsysinfo_getdevhddtemp(hddtempcmd,curdev)
-					if tempval > 0:
-						outputobj[curdev] = tempval
-				if curdev[0:4] == "nvme":
-					tempval = argonsysinfo_getdevnvmetemp(hddtempcmd,curdev)
-					if tempval > 0:
-						outputobj[curdev] = tempval
-			return outputobj
-		except:
-			return outputobj
-	return outputobj
+			proc = subprocess.Popen(cmdlist, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		except OSError:
+			return None
+		runcmd_procs.add(proc)
+	try:
+		output = proc.communicate(timeout=timeout)[0]
+	except subprocess.TimeoutExpired:
+		proc.kill()
+		try:
+			proc.communicate(timeout=0.5)
+		except subprocess.TimeoutExpired:
+			# Stuck in uninterruptible I/O, leave it to the kernel
+			pass
+		return None
+	finally:
+		with runcmd_lock:
+			runcmd_procs.discard(proc)
+	if runcmd_cancelled.is_set():
+		return None
+	return output.decode("utf-8", "ignore")
+
+def argonsysinfo_cancelcommands():
+	# Kill all running sensor commands and refuse new ones, i.e. on service stop
+	with runcmd_lock:
+		runcmd_cancelled.set()
+		for proc in runcmd_procs:
+			try:
+				proc.kill()
+			except OSError:
+				pass
+
+def argonsysinfo_gethwmontemp(hwmonfile):
+	try:
+		tempfp = open(hwmonfile, "r")
+		temp = tempfp.readline()
+		tempfp.close()
+		return float(int(temp)/1000)
+	except (IOError, ValueError):
+		return -1
+
+def argonsysinfo_listblockdevices():
+	global blockdev_inventory
+	# Always drain pending events, the first call also opens the uevent socket
+	changed = argonsysinfo_blockdevchanged()
+	if blockdev_inventory is None or changed:
+		blockdev_inventory = argonsysinfo_scanblockdevices()
+	return blockdev_inventory
+
+def argonsysinfo_scanblockdevices():
+	# Disks with temperature sensor from /sys/block
+	# type: nvme, usb (SATA bridge), hdd (rotational) or ssd
+	outputlist = []
+	try:
+		alldevs = sorted(os.listdir("/sys/block"))
+	except OSError:
+		return outputlist
+
+	for devname in alldevs:
+		syspath = os.path.realpath("/sys/block/"+devname)
+		if syspath.find("/nvme") >= 0:
+			devtype = "nvme"
+		elif syspath.find("/host") >= 0:
+			# SCSI disk, either via USB or directly attached SATA
+			if syspath.find("/usb") >= 0:
+				devtype = "usb"
+			elif argonsysinfo_readsysfs(syspath+"/queue/rotational") == "1":
+				devtype = "hdd"
+			else:
+				devtype = "ssd"
+		else:
+			# SD card, loop, ram, md, virtual disks ...
+			continue
 
-def argonsysinfo_getdevhddtemp(hddtempcmd, curdev):
-	cmdstr = ""
-	if hddtempcmd == BIN_PATH + "hddtemp":
-		cmdstr = BIN_PATH + "hddtemp -n sata:/dev/"+curdev
-	elif hddtempcmd == BIN_PATH + "smartctl":
-		cmdstr = BIN_PATH + "smartctl -d sat -A /dev/"+curdev+" | grep Temperature_Celsius | awk '{print $10}'"
+		hwmon = ""
+		hwmonlist = glob.glob(syspath+"/device/hwmon*/temp1_input") + glob.glob(syspath+"/device/hwmon/hwmon*/temp1_input")
+		if len(hwmonlist) > 0:
+			hwmon = hwmonlist[0]
+		outputlist.append({
+			"name": devname,
+			"type": devtype,
+			"rotational": argonsysinfo_readsysfs(syspath+"/queue/rotational") == "1",
+			"model": argonsysinfo_readsysfs(syspath+"/device/model"),
+			"hwmon": hwmon
+		})
+	return outputlist
 
+def argonsysinfo_blockdevchanged():
+	# True if a block device was added or removed since the last call
+	global blockdev_uevent
+	global blockdev_devmtime
+	if blockdev_uevent is None:
+		try:
+			blockdev_uevent = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+			blockdev_uevent.bind((0, 1))
+			blockdev_uevent.setblocking(False)
+		except (OSError, AttributeError):
+			blockdev_uevent = False
+
+	if blockdev_uevent is False:
+		# No uevent socket, device nodes in /dev change its mtime instead
+		try:
+			devmtime = os.stat("/dev").st_mtime
+		except OSError:
+			return False
+		changed = devmtime != blockdev_devmtime
+		blockdev_devmtime = devmtime
+		return changed
+
+	changed = False
+	while True:
+		try:
+			msg = blockdev_uevent.recv(8192)
+		except (BlockingIOError, InterruptedError):
+			break
+		except OSError:
+			# Receive buffer overrun, events were lost
+			changed = True
+			break
+		if (msg[0:4] == b"add@" or msg[0:7] == b"remove@") and msg.find(b"SUBSYSTEM=block\0") >= 0:
+			changed = True
+	return changed
+
+def argonsysinfo_getdevhddtemp(hddtempcmd, curdev):
 	tempval = 0
-	if len(cmdstr) > 0:
+	if hddtempcmd == BIN_PATH + "hddtemp":
+		# hddtemp checks the power mode itself and reports SLEEP instead of waking the disk
+		temperaturestr = argonsysinfo_runcmd([hddtempcmd, "-n", "sata:/dev/"+curdev])
+		if temperaturestr is not None and temperaturestr.find("SLEEP") >= 0:
+			return HDDTEMP_STANDBY
 		try:
-			temperaturestr = os.popen(cmdstr+" 2>&1").read()
 			tempval = float(temperaturestr)
 		except:
 			tempval = -1
+	elif hddtempcmd == BIN_PATH + "smartctl":
+		# -n standby: skip the query instead of spinning up a sleeping disk
+		temperaturestr = argonsysinfo_runcmd([hddtempcmd, "-d", "sat", "-n", "standby", "-A", "/dev/"+curdev])
+		if temperaturestr is None:
+			return -1
+		if temperaturestr.find("STANDBY mode") >= 0 or temperaturestr.find("SLEEP mode") >= 0:
+			return HDDTEMP_STANDBY
+		for temp in temperaturestr.split("\n"):
+			infolist = temp.split()
+			if len(infolist) >= 10 and infolist[1] == "Temperature_Celsius":
+				try:
+					tempval = float(infolist[9])
+				except ValueError:
+					tempval = -1
+				break
 
 	return tempval
 
 def argonsysinfo_getdevnvmetemp(hddtempcmd, curdev):
-	cmdstr = ""
-	if hddtempcmd == BIN_PATH + "smartctl":
-		cmdstr = BIN_PATH + "smartctl -d nvme -A /dev/"+curdev+" | grep Temperature: | awk '{print $2}'"
-
 	tempval = 0
-	if len(cmdstr) > 0:
-		try:
-			temperaturestr = os.popen(cmdstr+" 2>&1").read()
-			tempval = float(temperaturestr)
-		except:
-			tempval = -1
+	if hddtempcmd == BIN_PATH + "smartctl":
+		temperaturestr = argonsysinfo_runcmd([hddtempcmd, "-d", "nvme", "-A", "/dev/"+curdev])
+		if temperaturestr is None:
+			return -1
+		for temp in temperaturestr.split("\n"):
+			infolist = temp.split()
+			if len(infolist) >= 2 and infolist[0] == "Temperature:":
+				try:
+					tempval = float(infolist[1])
+				except ValueError:
+					tempval = -1
+				break
 
 	return tempval
 
@@ -249,76 +592,110 @@ def argonsysinfo_getip():
 	return ipaddr
 
 
-def argonsysinfo_getrootdev():
-	tmp = os.popen('mount').read()
-	alllines = tmp.split("\n")
+def argonsysinfo_listmounts():
+	# Mounted block devices from /proc/self/mountinfo
+	# Fields: id parent major:minor root mountpoint options [optional...] - fstype source superoptions
+	outputlist = []
+	try:
+		tempfp = open("/proc/self/mountinfo", "r")
+		alllines = tempfp.readlines()
+		tempfp.close()
+	except IOError:
+		return outputlist
 
 	for temp in alllines:
-		temp = temp.replace('\t', ' ')
-		temp = temp.strip()
-		while temp.find("  ") >= 0:
-			temp = temp.replace("  ", " ")
-		infolist = temp.split(" ")
-		if len(infolist) >= 3:
+		infolist = temp.strip().split(" ")
+		if len(infolist) < 10:
+			continue
+		try:
+			sepidx = infolist.index("-", 6)
+		except ValueError:
+			continue
+		if sepidx+2 >= len(infolist):
+			continue
+		source = infolist[sepidx+2]
+		if source[0:5] != "/dev/":
+			continue
+		# Resolve the kernel name via major:minor, this also maps /dev/root
+		devname = argonsysinfo_getdevname(infolist[2])
+		if devname == "":
+			devname = source[source.rfind("/")+1:]
+		mountpoint = infolist[4].replace("\\040", " ").replace("\\011", "\t").replace("\\012", "\n").replace("\\134", "\\")
+		outputlist.append({"dev": devname, "devnum": infolist[2], "mountpoint": mountpoint, "fstype": infolist[sepidx+1]})
+	return outputlist
 
-			if infolist[2] == "/":
-				return infolist[0]
+def argonsysinfo_getdevname(devnum):
+	# Kernel block device name for a major:minor pair (i.e. 179:2 to mmcblk0p2)
+	try:
+		return os.path.basename(os.path.realpath("/sys/dev/block/"+devnum))
+	except OSError:
+		return ""
+
+def argonsysinfo_getparentdev(devname):
+	# Whole disk a partition belongs to (i.e. sda1 to sda, nvme0n1p2 to nvme0n1)
+	if os.path.exists("/sys/block/"+devname):
+		return devname
+	if os.path.exists("/sys/class/block/"+devname+"/partition"):
+		# /sys/class/block/sda1 -> ../../devices/.../block/sda/sda1
+		parentdev = os.path.basename(os.path.dirname(os.path.realpath("/sys/class/block/"+devname)))
+		if os.path.exists("/sys/block/"+parentdev):
+			return parentdev
+	return devname
+
+def argonsysinfo_listraidmembers():
+	# Block devices that are part of a RAID setup
+	hddlist = []
+	try:
+		for devname in os.listdir("/sys/block"):
+			if devname[0:2] != "md":
+				continue
+			try:
+				hddlist.extend(os.listdir("/sys/block/"+devname+"/slaves"))
+			except OSError:
+				continue
+	except OSError:
+		pass
+	return hddlist
+
+def argonsysinfo_getrootdev():
+	for curmount in argonsysinfo_listmounts():
+		if curmount["mountpoint"] == "/":
+			return "/dev/"+curmount["dev"]
 	return ""
 
 def argonsysinfo_listhddusage():
 	outputobj = {}
-	raidlist = argonsysinfo_listraid()
-	raiddevlist = []
-	raidctr = 0
-	while raidctr < len(raidlist['raidlist']):
-		raiddevlist.append(raidlist['raidlist'][raidctr]['title'])
-		# TODO: May need to use different method for each raid type (i.e. check raidlist['raidlist'][raidctr]['value'])
-		#outputobj[raidlist['raidlist'][raidctr]['title']] = {"used":int(raidlist['raidlist'][raidctr]['info']['used']), "total":int(raidlist['raidlist'][raidctr]['info']['size'])}
-		raidctr = raidctr + 1
+	raidmembers = argonsysinfo_listraidmembers()
+	donedevnum = []
 
-	rootdev = argonsysinfo_getrootdev()
+	for curmount in argonsysinfo_listmounts():
+		# Skip bind mounts and devices mounted more than once
+		if curmount["devnum"] in donedevnum:
+			continue
+		donedevnum.append(curmount["devnum"])
 
-	tmp = os.popen('df').read()
-	alllines = tmp.split("\n")
+		curdev = curmount["dev"]
+		if curdev in raidmembers:
+			# Skip devices that are part of a RAID setup
+			continue
+		try:
+			stat = os.statvfs(curmount["mountpoint"])
+		except OSError:
+			continue
+		# Same 1K-block figures as df
+		total = int(stat.f_blocks*stat.f_frsize/1024)
+		used = int((stat.f_blocks-stat.f_bfree)*stat.f_frsize/1024)
 
-	for temp in alllines:
-		temp = temp.replace('\t', ' ')
-		temp = temp.strip()
-		while temp.find("  ") >= 0:
-			temp = temp.replace("  ", " ")
-		infolist = temp.split(" ")
-		if len(infolist) >= 6:
-			if infolist[1] == "Size":
-				continue
-			if len(infolist[0]) < 5:
-				continue
-			elif infolist[0][0:5] != "/dev/":
-				continue
-			curdev = infolist[0]
-			if curdev == "/dev/root" and rootdev != "":
-				curdev = rootdev
-			tmpidx = curdev.rfind("/")
-			if tmpidx >= 0:
-				curdev = curdev[tmpidx+1:]
-
-			if curdev in raidlist['hddlist']:
-				# Skip devices that are part of a RAID setup
-				continue
-			elif curdev in raiddevlist:
-				# Skip RAID ID that already have size data
-				# (use df information otherwise)
-				if curdev in outputobj:
-					continue
-			elif curdev[0:2] == "sd" or curdev[0:2] == "hd":
-				curdev = curdev[0:-1]
-			else:
-				curdev = curdev[0:-2]
+		parentdev = argonsysinfo_getparentdev(curdev)
+		if parentdev[0:2] == "md" and parentdev in outputobj:
+			# Skip RAID ID that already have size data
+			continue
 
-			# Aggregate values (i.e. sda1, sda2 to sda)
-			if curdev in outputobj:
-				outputobj[curdev] = {"used":outputobj[curdev]['used']+int(infolist[2]), "total":outputobj[curdev]['total']+int(infolist[1])}
-			else:
-				outputobj[curdev] = {"used":int(infolist[2]), "total":int(infolist[1])}
+		# Aggregate values (i.e. sda1, sda2 to sda)
+		if parentdev in outputobj:
+			outputobj[parentdev] = {"used":outputobj[parentdev]['used']+used, "total":outputobj[parentdev]['total']+total}
+		else:
+			outputobj[parentdev] = {"used":used, "total":total}
 
 	return outputobj
 
@@ -346,7 +723,7 @@ def argonsysinfo_listraid():
 	outputlist = []
 	# cat /proc/mdstat
 	# multiple mdxx from mdstat
-	# mdadm -D /dev/md1
+	# details from /sys/block/mdxx/md
 
 	ramtotal = 0
 	errorflag = False
@@ -386,55 +763,81 @@ def argonsysinfo_listraid():
 	return {"raidlist": outputlist, "hddlist": hddlist}
 
 
+def argonsysinfo_readsysfs(fname, default = ""):
+	try:
+		tempfp = open(fname, "r")
+		temp = tempfp.readline().strip()
+		tempfp.close()
+		return temp
+	except (IOError, OSError):
+		return default
+
 def argonsysinfo_getraiddetail(devname):
-	state = ""
-	raidtype = ""
-	size = 0
-	used = 0
+	# Same figures as mdadm -D /dev/mdX, read from /sys/block/mdX/md
+	mdpath = "/sys/block/"+devname+"/md/"
+	raidtype = argonsysinfo_readsysfs(mdpath+"level")
+	state = argonsysinfo_readsysfs(mdpath+"array_state")
+	# Array size in 512 byte sectors, component size in KB
+	size = int(argonsysinfo_readsysfs("/sys/block/"+devname+"/size", "0"))>>1
+	used = argonsysinfo_readsysfs(mdpath+"component_size", "0")
+	if not used.isdigit():
+		used = 0
+	raiddisks = argonsysinfo_readsysfs(mdpath+"raid_disks", "0")
+	if not raiddisks.isdigit():
+		raiddisks = 0
+	degraded = argonsysinfo_readsysfs(mdpath+"degraded", "0")
+	if not degraded.isdigit():
+		degraded = 0
+
 	total = 0
-	working = 0
 	active = 0
 	failed = 0
 	spare = 0
+	try:
+		alldevs = os.listdir(mdpath)
+	except OSError:
+		alldevs = []
+	for curdev in alldevs:
+		if curdev[0:4] != "dev-":
+			continue
+		total = total + 1
+		devstate = argonsysinfo_readsysfs(mdpath+curdev+"/state").split(",")
+		if "faulty" in devstate:
+			failed = failed + 1
+		elif "spare" in devstate:
+			spare = spare + 1
+		elif "in_sync" in devstate:
+			active = active + 1
+	working = total - failed
+
+	# Fewer working members than the array was built with
+	if int(degraded) > 0 or working < int(raiddisks):
+		state = "degraded"
 	rebuildstat = ""
-	tmp = os.popen('mdadm -D /dev/'+devname).read()
-	alllines = tmp.split("\n")
-
-	for temp in alllines:
-		temp = temp.replace('\t', ' ')
-		temp = temp.strip()
-		while temp.find("  ") >= 0:
-			temp = temp.replace("  ", " ")
-		infolist = temp.split(" : ")
-		if len(infolist) == 2:
-			if infolist[0].lower() == "raid level":
-				raidtype = infolist[1]
-			elif infolist[0].lower() == "array size":
-				tmpidx = infolist[1].find(" ")
-				if tmpidx > 0:
-					size = (infolist[1][0:tmpidx])
-			elif infolist[0].lower() == "used dev size":
-				tmpidx = infolist[1].find(" ")
-				if tmpidx > 0:
-					used = (infolist[1][0:tmpidx])
-			elif infolist[0].lower() == "state":
-				tmpidx = infolist[1].rfind(" ") 
-				if tmpidx > 0:
-					state = (infolist[1][tmpidx+1:])
-				else:
-					state = infolist[1]
-			elif infolist[0].lower() == "total devices":
-				total = infolist[1]
-			elif infolist[0].lower() == "active devices":
-				active = infolist[1]
-			elif infolist[0].lower() == "working devices":
-				working = infolist[1]
-			elif infolist[0].lower() == "failed devices":
-				failed = infolist[1]
-			elif infolist[0].lower() == "spare devices":
-				spare = infolist[1]
-			elif infolist[0].lower() == "rebuild status":
-				tmpidx = infolist[1].find("%") 
-				if tmpidx > 0:
-					rebuildstat = (infolist[1][0:tmpidx])+"%"
-	return {"state": state, "raidtype": raidtype, "size": int(size), "used": int(used), "devices": int(total), "active": int(active), "working": int(working), "failed": int(failed), "spare": int(spare), "rebuildstat": rebuildstat}
+	syncaction = argonsysinfo_readsysfs(mdpath+"sync_action", "idle")
+	if syncaction != "idle":
+		if syncaction == "recover":
+			state = "recovering"
+		elif syncaction == "resync":
+			state = "resyncing"
+		else:
+			state = syncaction
+		# sync_completed: "<done> / <total>" in sectors or "none"
+		infolist = argonsysinfo_readsysfs(mdpath+"sync_completed", "none").split(" / ")
+		if len(infolist) == 2 and infolist[0].isdigit() and infolist[1].isdigit() and int(infolist[1]) > 0:
+			rebuildstat = str(int(100*int(infolist[0])/int(infolist[1])))+"%"
+	return {"state": state, "raidtype": raidtype, "size": int(size), "used": int(used), "devices": int(total), "expected": int(raiddisks), "active": int(active), "working": int(working), "failed": int(failed), "spare": int(spare), "rebuildstat": rebuildstat}
+
+def argonsysinfo_israidrebuilding():
+	# Cheap check for a running resync/recovery of any md array
+	try:
+		alldevs = os.listdir("/sys/block")
+	except OSError:
+		return False
+	for devname in alldevs:
+		if devname[0:2] != "md":
+			continue
+		syncaction = argonsysinfo_readsysfs("/sys/block/"+devname+"/md/sync_action", "idle")
+		if syncaction != "idle" and syncaction != "frozen":
+			return True
+	return False
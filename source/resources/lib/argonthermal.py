@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+#
+# Kernel thermal netlink helper methods
+#
+# Subscribes to the trip point and temperature sampling notifications of the
+# "thermal" generic netlink family (linux/thermal.h). For testing without real
+# trip events, argonthermal_openlocal() returns a stand-in subscriber and a
+# socket to inject messages in the same wire format.
+#
+import select
+import socket
+import struct
+
+# linux/netlink.h, linux/genetlink.h
+NETLINK_GENERIC = 16
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+NLM_F_REQUEST = 1
+NLMSG_ERROR = 2
+NLA_TYPE_MASK = 0x3fff
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+CTRL_ATTR_MCAST_GROUPS = 7
+CTRL_ATTR_MCAST_GRP_NAME = 1
+CTRL_ATTR_MCAST_GRP_ID = 2
+
+# linux/thermal.h
+THERMAL_GENL_FAMILY_NAME = 'thermal'
+THERMAL_GENL_SAMPLING_GROUP_NAME = 'sampling'
+THERMAL_GENL_EVENT_GROUP_NAME = 'event'
+THERMAL_GENL_ATTR_TZ_ID = 2
+THERMAL_GENL_ATTR_TZ_TEMP = 3
+THERMAL_GENL_ATTR_TZ_TRIP_ID = 5
+THERMAL_GENL_SAMPLING_TEMP = 0
+THERMAL_GENL_EVENT_TZ_TRIP_UP = 5
+THERMAL_GENL_EVENT_TZ_TRIP_DOWN = 6
+
+# Family ID used by the local stand-in socket
+LOCAL_FAMILY_ID = 0xffff
+
+
+def argonthermal_packattr(attrtype, payload):
+    attr = struct.pack('=HH', 4 + len(payload), attrtype) + payload
+    return attr + b'\0' * (-len(attr) % 4)
+
+
+def argonthermal_parseattrs(data):
+    attrs = {}
+    offset = 0
+    while offset + 4 <= len(data):
+        attrlen, attrtype = struct.unpack_from('=HH', data, offset)
+        if attrlen < 4:
+            break
+        attrs[attrtype & NLA_TYPE_MASK] = data[offset + 4:offset + attrlen]
+        offset = offset + ((attrlen + 3) & ~3)
+    return attrs
+
+
+def argonthermal_packmsg(msgtype, cmd, attrs, seq=0):
+    payload = struct.pack('=BBH', cmd, 1, 0) + attrs
+    return struct.pack('=IHHII', 16 + len(payload), msgtype, NLM_F_REQUEST, seq, 0) + payload
+
+
+# Resolve the thermal family and join its multicast groups
+def argonthermal_open():
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+    except (OSError, AttributeError):
+        return None
+    try:
+        sock.bind((0, 0))
+        sock.settimeout(1)
+        sock.send(argonthermal_packmsg(GENL_ID_CTRL, CTRL_CMD_GETFAMILY,
+            argonthermal_packattr(CTRL_ATTR_FAMILY_NAME, THERMAL_GENL_FAMILY_NAME.encode() + b'\0'), 1))
+        data = sock.recv(65536)
+        msglen, msgtype = struct.unpack_from('=IH', data, 0)
+        if msgtype == NLMSG_ERROR:
+            # family not registered, kernel without CONFIG_THERMAL_NETLINK
+            sock.close()
+            return None
+        attrs = argonthermal_parseattrs(data[20:msglen])
+        familyid = struct.unpack('=H', attrs[CTRL_ATTR_FAMILY_ID][0:2])[0]
+        groups = argonthermal_parseattrs(attrs.get(CTRL_ATTR_MCAST_GROUPS, b''))
+        joined = 0
+        for group in groups.values():
+            groupattrs = argonthermal_parseattrs(group)
+            groupname = groupattrs.get(CTRL_ATTR_MCAST_GRP_NAME, b'').rstrip(b'\0').decode()
+            if groupname in (THERMAL_GENL_SAMPLING_GROUP_NAME, THERMAL_GENL_EVENT_GROUP_NAME):
+                groupid = struct.unpack('=I', groupattrs[CTRL_ATTR_MCAST_GRP_ID][0:4])[0]
+                sock.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, groupid)
+                joined = joined + 1
+        if joined == 0:
+            sock.close()
+            return None
+        sock.setblocking(False)
+        return (sock, familyid)
+    except (OSError, KeyError, struct.error):
+        sock.close()
+        return None
+
+
+# Stand-in subscriber, messages written to the returned socket are read as kernel notifications
+def argonthermal_openlocal():
+    sock, injectsock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    return (sock, LOCAL_FAMILY_ID), injectsock
+
+
+# value is the temperature in millidegree for samples, the trip ID for trip events
+def argonthermal_sendlocal(injectsock, cmd, tzid, value):
+    attrs = argonthermal_packattr(THERMAL_GENL_ATTR_TZ_ID, struct.pack('=I', tzid))
+    if cmd == THERMAL_GENL_SAMPLING_TEMP:
+        attrs = attrs + argonthermal_packattr(THERMAL_GENL_ATTR_TZ_TEMP, struct.pack('=i', value))
+    else:
+        attrs = attrs + argonthermal_packattr(THERMAL_GENL_ATTR_TZ_TRIP_ID, struct.pack('=I', value))
+    injectsock.send(argonthermal_packmsg(LOCAL_FAMILY_ID, cmd, attrs))
+
+
+def argonthermal_close(subscriber):
+    if subscriber is not None:
+        subscriber[0].close()
+
+
+# Wait up to timeout seconds for notifications, or until wakefd becomes readable
+# Returns a list of {"cmd": ..., "tz": ..., "temp": milli°C or None, "trip": ID or None}
+def argonthermal_read(subscriber, timeout, wakefd=None):
+    sock, familyid = subscriber
+    events = []
+    waitlist = [sock]
+    if wakefd is not None:
+        waitlist.append(wakefd)
+    readable = select.select(waitlist, [], [], timeout)[0]
+    if sock not in readable:
+        return events
+    while True:
+        try:
+            data = sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            break
+        offset = 0
+        while offset + 20 <= len(data):
+            msglen, msgtype = struct.unpack_from('=IH', data, offset)
+            if msglen < 20:
+                break
+            if msgtype == familyid:
+                cmd = data[offset + 16]
+                attrs = argonthermal_parseattrs(data[offset + 20:offset + msglen])
+                event = {"cmd": cmd, "tz": None, "temp": None, "trip": None}
+                if THERMAL_GENL_ATTR_TZ_ID in attrs:
+                    event["tz"] = struct.unpack('=I', attrs[THERMAL_GENL_ATTR_TZ_ID][0:4])[0]
+                if THERMAL_GENL_ATTR_TZ_TEMP in attrs:
+                    event["temp"] = struct.unpack('=i', attrs[THERMAL_GENL_ATTR_TZ_TEMP][0:4])[0]
+                if THERMAL_GENL_ATTR_TZ_TRIP_ID in attrs:
+                    event["trip"] = struct.unpack('=I', attrs[THERMAL_GENL_ATTR_TZ_TRIP_ID][0:4])[0]
+                events.append(event)
+            offset = offset + ((msglen + 3) & ~3)
+    return events
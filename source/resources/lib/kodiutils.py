@@ -22,6 +22,10 @@ def show_settings():
     ADDON.openSettings()
 
 
+def show_text(header, text):
+    xbmcgui.Dialog().textviewer(header, text)
+
+
 def get_setting(setting):
     return ADDON.getSetting(setting).strip().decode('utf-8')
 
@@ -2,9 +2,14 @@
 
 from threading import Thread
 from threading import Event
+import time
 
-import xbmc
-import xbmcaddon
+try:
+    import xbmc
+    import xbmcaddon
+except ImportError:
+    # Standalone daemon without Kodi, see daemon.py
+    from resources.lib.argonheadless import xbmc, xbmcaddon
 
 from resources.lib import argon
 
@@ -17,34 +22,95 @@ def thread_fan(abort_flag):
     argon.temp_check(abort_flag)
 
 
-def run():
+def thread_watchdog(abort_flag):
+    argon.thermal_watchdog(abort_flag)
+
+
+def thread_thermalevents(abort_flag):
+    argon.thermal_events(abort_flag)
+
+
+def thread_pushreceiver(abort_flag):
+    argon.push_receiver(abort_flag)
+
+
+def thread_status(abort_flag):
+    argon.status_refresher(abort_flag)
+
+
+def run(headless=False):
     ADDON = xbmcaddon.Addon()
 
+    if not headless and ADDON.getSettingBool('headless_daemon'):
+        # The standalone daemon owns the I2C bus and the power button
+        xbmc.log(msg='Argon ONE Control: fan and power button control left to the headless daemon', level=xbmc.LOGINFO)
+        xbmc.Monitor().waitForAbort()
+        return
+
+    # Fan control first, file provisioning in the background
+    t0 = argon.startup()
     monitor = argon.SettingMonitor()
+    player = argon.PlaybackMonitor()
 
     abort_flag = Event()
     power_button = Event()
-    t1 = Thread(target = thread_fan, args=(abort_flag,))
-    t1.start()
-    xbmc.log(msg='Argon ONE Control: fan control thread started', level=xbmc.LOGDEBUG)
-
     powerbutton = ADDON.getSettingBool('powerbutton')
     if powerbutton:
         power_button.set()
-    t2 = Thread(target = thread_powerbutton, args=(abort_flag, power_button,))
-    t2.start()
-    xbmc.log(msg='Argon ONE Control: power button monitoring thread started', level=xbmc.LOGDEBUG)
-
-    while not monitor.abortRequested():
-        # Sleep/wait for abort for 1 seconds
-        if monitor.waitForAbort(1):
-            # Abort was requested while waiting. We should exit
-            break
+
+    if ADDON.getSettingBool('service_core'):
+        # Everything in this thread, returns on abort
+        xbmc.log(msg='Argon ONE Control: single-thread service core started after {:.0f} ms'.format((time.monotonic()-argon.startup_time)*1000), level=xbmc.LOGDEBUG)
+        t2 = argon.service_core(monitor, abort_flag, power_button)
+        workers = []
+        if t2 is not None:
+            workers.append(('power button monitoring', t2))
+    else:
+        t1 = Thread(target = thread_fan, args=(abort_flag,), daemon=True)
+        t1.start()
+        xbmc.log(msg='Argon ONE Control: fan control thread started', level=xbmc.LOGDEBUG)
+        t3 = Thread(target = thread_watchdog, args=(abort_flag,), daemon=True)
+        t3.start()
+        xbmc.log(msg='Argon ONE Control: thermal watchdog thread started', level=xbmc.LOGDEBUG)
+        t4 = Thread(target = thread_thermalevents, args=(abort_flag,), daemon=True)
+        t4.start()
+        xbmc.log(msg='Argon ONE Control: thermal notification thread started', level=xbmc.LOGDEBUG)
+        t5 = Thread(target = thread_pushreceiver, args=(abort_flag,), daemon=True)
+        t5.start()
+        xbmc.log(msg='Argon ONE Control: temperature push thread started', level=xbmc.LOGDEBUG)
+        t6 = Thread(target = thread_status, args=(abort_flag,), daemon=True)
+        t6.start()
+        xbmc.log(msg='Argon ONE Control: status refresh thread started', level=xbmc.LOGDEBUG)
+        t2 = Thread(target = thread_powerbutton, args=(abort_flag, power_button,), daemon=True)
+        t2.start()
+        xbmc.log(msg='Argon ONE Control: power button monitoring thread started', level=xbmc.LOGDEBUG)
+        xbmc.log(msg='Argon ONE Control: all threads started after {:.0f} ms'.format((time.monotonic()-argon.startup_time)*1000), level=xbmc.LOGDEBUG)
+        workers = [('fan control', t1), ('power button monitoring', t2), ('thermal watchdog', t3), ('thermal notification', t4), ('temperature push', t5), ('status refresh', t6)]
+
+        while not monitor.abortRequested():
+            # Sleep/wait for abort for 1 seconds
+            if monitor.waitForAbort(1):
+                # Abort was requested while waiting. We should exit
+                break
+    stop_budget = ADDON.getSettingInt('stop_budget')/1000
+    stop_start = time.monotonic()
     abort_flag.set()
     power_button.set()
-    t1.join()
-    t2.join()
+    argon.request_stop()
+    stop_deadline = stop_start + stop_budget
+    running = []
+    for name, t in workers + [('file provisioning', t0)]:
+        t.join(max(0, stop_deadline - time.monotonic()))
+        if t.is_alive():
+            xbmc.log(msg='Argon ONE Control: ' + name + ' thread still running after the stop budget', level=xbmc.LOGWARNING)
+            running.append(name)
+        else:
+            xbmc.log(msg='Argon ONE Control: ' + name + ' thread stopped after {:.0f} ms'.format((time.monotonic()-stop_start)*1000), level=xbmc.LOGDEBUG)
+    if running:
+        # The abort flags stay set, so the remaining threads still stop on their own
+        xbmc.log(msg='Argon ONE Control: cleanup skipped, still running : ' + ', '.join(running), level=xbmc.LOGWARNING)
+        return
     abort_flag.clear()
     power_button.clear()
-    xbmc.log(msg='Argon ONE Control: workerthreads stopped', level=xbmc.LOGDEBUG)
+    xbmc.log(msg='Argon ONE Control: workerthreads stopped after {:.0f} ms'.format((time.monotonic()-stop_start)*1000), level=xbmc.LOGDEBUG)
     argon.cleanup()
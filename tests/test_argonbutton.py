@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+#
+# Tests of the power button gesture decoder on edge timestamps
+#
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source', 'resources', 'lib'))
+
+import argonbutton
+
+MS = 1000000
+
+
+class ArgonButtonTest(unittest.TestCase):
+    def setUp(self):
+        self.state = argonbutton.argonbutton_newstate()
+        self.now = 1000 * MS
+
+    def pulse(self, width_ms, gap_ms=200):
+        # One press of width_ms after gap_ms, returns the gestures decoded on both edges
+        self.now = self.now + gap_ms * MS
+        gestures = [argonbutton.argonbutton_edge(self.state, True, self.now)]
+        self.now = self.now + int(width_ms * MS)
+        gestures.append(argonbutton.argonbutton_edge(self.state, False, self.now))
+        return [gesture for gesture in gestures if gesture is not None]
+
+    def expire(self):
+        self.now = self.now + argonbutton.ARGONBUTTON_TAP_GAP * MS
+        return argonbutton.argonbutton_expire(self.state, self.now)
+
+    def test_noise(self):
+        self.assertEqual(self.pulse(5), [])
+        self.assertIsNone(self.expire())
+
+    def test_mcu_double(self):
+        for width in [20, 25, 30, 33, 35]:
+            self.assertEqual(self.pulse(width), ['double'], width)
+
+    def test_mcu_hold(self):
+        for width in [38, 40, 45, 50, 55]:
+            self.assertEqual(self.pulse(width), ['hold'], width)
+
+    def test_taps(self):
+        self.assertEqual(self.pulse(100), [])
+        self.assertEqual(self.expire(), 'single')
+        self.assertEqual(self.pulse(100), [])
+        self.assertEqual(self.pulse(100), [])
+        self.assertEqual(self.expire(), 'double')
+        self.assertEqual(self.pulse(100) + self.pulse(100) + self.pulse(100), ['triple'])
+        self.assertIsNone(self.expire())
+
+    def test_tap_gap(self):
+        # A tap after the gap starts a new gesture, the previous one is decoded on its edge
+        self.assertEqual(self.pulse(100), [])
+        self.assertEqual(self.pulse(100, argonbutton.ARGONBUTTON_TAP_GAP + 50), ['single'])
+        self.assertEqual(self.expire(), 'single')
+
+    def test_hold(self):
+        self.assertEqual(self.pulse(argonbutton.ARGONBUTTON_HOLD), ['hold'])
+
+    def test_tap_then_hold(self):
+        self.assertEqual(self.pulse(100), [])
+        self.assertEqual(self.pulse(2000), ['hold'])
+        self.assertIsNone(self.expire())
+
+    def test_timeout(self):
+        self.assertIsNone(argonbutton.argonbutton_timeout(self.state, self.now))
+        self.pulse(100)
+        self.assertAlmostEqual(argonbutton.argonbutton_timeout(self.state, self.now), argonbutton.ARGONBUTTON_TAP_GAP / 1000)
+        # Not expired while pressed
+        argonbutton.argonbutton_edge(self.state, True, self.now + 10 * MS)
+        self.assertIsNone(argonbutton.argonbutton_timeout(self.state, self.now + 10 * MS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+#
+# Tests of the model fit and the fan curve proposal of the fan calibration,
+# with synthetic first-order step responses
+#
+import math
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source', 'resources', 'lib'))
+
+import argoncalibrate
+
+
+def stepresponse(starttemp, steadytemp, tau, times):
+    return [(t, steadytemp + (starttemp - steadytemp) * math.exp(-t / tau)) for t in times]
+
+
+class ArgonCalibrateFitTest(unittest.TestCase):
+    def test_heating(self):
+        steadytemp, tau = argoncalibrate.argoncalibrate_fit(stepresponse(40, 60, 30, range(0, 180)))
+        self.assertAlmostEqual(steadytemp, 60, places=6)
+        # The slope between two samples overestimates tau by about half a sample interval
+        self.assertAlmostEqual(tau, 30, delta=1)
+
+    def test_cooling_irregular(self):
+        times = [0, 1, 3, 4, 5, 7, 8, 10, 11, 12, 14, 15, 17, 18, 20, 22, 23, 25, 26, 28, 30]
+        steadytemp, tau = argoncalibrate.argoncalibrate_fit(stepresponse(70, 50, 20, times))
+        self.assertAlmostEqual(steadytemp, 50, delta=0.5)
+        self.assertAlmostEqual(tau, 20, delta=1)
+
+    def test_flat(self):
+        # Without a trend there is no time constant, the tail mean is the steady state
+        self.assertEqual(argoncalibrate.argoncalibrate_fit([(t, 50) for t in range(4)]), (50, None))
+
+    def test_too_few(self):
+        self.assertEqual(argoncalibrate.argoncalibrate_fit([(0, 50), (1, 51)]), (51, None))
+        self.assertEqual(argoncalibrate.argoncalibrate_fit([]), (None, None))
+
+    def test_duplicate_times(self):
+        samples = stepresponse(40, 60, 30, range(0, 60))
+        samples = samples[:10] + [samples[9]] + samples[10:]
+        steadytemp, tau = argoncalibrate.argoncalibrate_fit(samples)
+        self.assertAlmostEqual(steadytemp, 60, places=6)
+
+
+class ArgonCalibrateCurveTest(unittest.TestCase):
+    def test_curve(self):
+        steadystates = {100: 45, 75: 48, 50: 52, 30: 58, 10: 66, 0: 72}
+        self.assertEqual(argoncalibrate.argoncalibrate_curve(steadystates, 60), [(51, 50), (55, 75), (59, 100)])
+
+    def test_interpolated(self):
+        # 33 % is rounded up to 35 %, its steady state is between the 33 % and 100 % steps
+        steadystates = {100: 45, 33: 55, 0: 70}
+        self.assertEqual(argoncalibrate.argoncalibrate_curve(steadystates, 60), [(53, 35), (56, 65), (59, 100)])
+
+    def test_no_fan_needed(self):
+        steadystates = {100: 40, 75: 41, 50: 42, 30: 43, 10: 44, 0: 45}
+        self.assertEqual(argoncalibrate.argoncalibrate_curve(steadystates, 70), [(46, 10), (57, 55), (69, 100)])
+
+    def test_too_hot(self):
+        # Even full speed doesn't reach the target, the curve stays ordered below it
+        steadystates = {100: 70, 75: 72, 50: 74, 30: 76, 10: 78, 0: 80}
+        self.assertEqual(argoncalibrate.argoncalibrate_curve(steadystates, 60), [(57, 100), (58, 100), (59, 100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
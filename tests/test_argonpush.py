@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+#
+# Tests of the temperature push datagrams, their TTL and the store of the
+# newest readings, with a socket in a temporary directory
+#
+import os
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source', 'resources', 'lib'))
+
+import argonpush
+
+
+class ArgonPushParseTest(unittest.TestCase):
+    def test_reading(self):
+        self.assertEqual(argonpush.argonpush_parse(b'ambient 31.5 120\n', 1000), [('ambient', 31.5, 1120)])
+
+    def test_default_ttl(self):
+        self.assertEqual(argonpush.argonpush_parse(b'ambient 31.5', 1000), [('ambient', 31.5, 1000 + argonpush.ARGONPUSH_TTL)])
+
+    def test_max_ttl(self):
+        self.assertEqual(argonpush.argonpush_parse(b'ambient 31.5 86400', 1000), [('ambient', 31.5, 1000 + argonpush.ARGONPUSH_MAX_TTL)])
+
+    def test_lines(self):
+        data = b'ambient 31.5\r\nssd 45 30\n\nnvme 50 10 extra\n'
+        self.assertEqual(argonpush.argonpush_parse(data, 0), [('ambient', 31.5, argonpush.ARGONPUSH_TTL), ('ssd', 45.0, 30)])
+
+    def test_invalid(self):
+        for data in [b'ambient', b'ambient warm', b'ambient 31.5 long', b'ambient nan', b'ambient 151',
+                     b'ambient -41', b'ambient 31.5 0', b'ambient 31.5 -10', b'\xff\xfe 31.5 x']:
+            self.assertEqual(argonpush.argonpush_parse(data, 0), [], data)
+
+    def test_limits(self):
+        data = b'low -40\nhigh 150\n'
+        self.assertEqual([reading[1] for reading in argonpush.argonpush_parse(data, 0)], [-40, 150])
+
+
+class ArgonPushStoreTest(unittest.TestCase):
+    def test_newest(self):
+        store = {}
+        argonpush.argonpush_store(store, [('ambient', 30.0, 160), ('ambient', 31.0, 130)], 100)
+        self.assertEqual(argonpush.argonpush_get(store, 'ambient', 100), 31.0)
+
+    def test_expired_dropped(self):
+        store = {}
+        argonpush.argonpush_store(store, [('ambient', 30.0, 160), ('ssd', 45.0, 120)], 100)
+        argonpush.argonpush_store(store, [], 120)
+        self.assertEqual(list(store), ['ambient'])
+
+    def test_get(self):
+        store = {}
+        argonpush.argonpush_store(store, [('ambient', 30.0, 160)], 100)
+        self.assertEqual(argonpush.argonpush_get(store, 'ambient', 159.9), 30.0)
+        with self.assertRaises(ValueError):
+            argonpush.argonpush_get(store, 'ambient', 160)
+        self.assertEqual(store, {})
+        with self.assertRaises(ValueError):
+            argonpush.argonpush_get(store, 'ssd', 100)
+
+    def test_retry(self):
+        retrystate = {}
+        delays = [argonpush.argonpush_retry(retrystate, 100) for idx in range(8)]
+        self.assertEqual(delays[:3], [argonpush.ARGONPUSH_RETRY, argonpush.ARGONPUSH_RETRY * 2, argonpush.ARGONPUSH_RETRY * 4])
+        self.assertEqual(delays[-1], argonpush.ARGONPUSH_RETRY_MAX)
+        self.assertEqual(retrystate['due'], 100 + argonpush.ARGONPUSH_RETRY_MAX)
+
+
+class ArgonPushSocketTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'push.sock')
+        self.sock = argonpush.argonpush_open(self.path)
+        self.assertIsNotNone(self.sock)
+        self.addCleanup(argonpush.argonpush_close, self.sock, self.path)
+
+    def send(self, data):
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.sendto(data, self.path)
+        sender.close()
+
+    def test_read(self):
+        self.send(b'ambient 31.5 120')
+        self.send(b'ssd 45\nbroken')
+        readings = argonpush.argonpush_read(self.sock, 1)
+        self.assertEqual([reading[:2] for reading in readings], [('ambient', 31.5), ('ssd', 45.0)])
+
+    def test_timeout(self):
+        self.assertEqual(argonpush.argonpush_read(self.sock, 0), [])
+
+    def test_in_use(self):
+        # A second receiver leaves the socket of the running one alone
+        self.assertIsNone(argonpush.argonpush_open(self.path))
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_left_over(self):
+        self.sock.close()
+        sock = argonpush.argonpush_open(self.path)
+        self.assertIsNotNone(sock)
+        sock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
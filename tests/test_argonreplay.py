@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+#
+# Tests of the trace loading and the statistics of the fan policy replay on a
+# small CSV trace, without the fan control of argon.py
+#
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source', 'resources', 'lib'))
+
+import argonreplay
+
+TRACE = '''time,CPU,GPU,load,note
+30,60.0,58.5,80,
+0,50.0,49.0,10,
+10,,51.5,20,warm
+bad,99.0,99.0,99,
+20,56.5,55.0,xx,
+'''
+
+LOG = '''23:59:58.500 T:1234 debug <general>: Argon ONE Control: current CPU temperature : 51.5
+23:59:58.500 T:1234 debug <general>: Argon ONE Control: current GPU temperature : 49.0
+23:59:59.000 T:1234 debug <general>: Argon ONE Control: some other line
+00:00:01.500 T:1234 debug <general>: Argon ONE Control: current CPU temperature : 52.0
+'''
+
+
+class ArgonReplayTest(unittest.TestCase):
+    def writetrace(self, suffix, content):
+        fd, fname = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(content)
+        self.addCleanup(os.unlink, fname)
+        return fname
+
+    def test_loadcsv(self):
+        samples = argonreplay.argonreplay_load(self.writetrace('.csv', TRACE))
+        self.assertEqual([sample[0] for sample in samples], [0, 10, 20, 30])
+        self.assertEqual(samples[0][1], {'CPU': 50.0, 'GPU': 49.0, 'load': 10.0})
+        # Empty and non-numeric cells are left out
+        self.assertEqual(samples[1][1], {'GPU': 51.5, 'load': 20.0})
+        self.assertEqual(samples[2][1], {'CPU': 56.5, 'GPU': 55.0})
+
+    def test_loadlog(self):
+        samples = argonreplay.argonreplay_load(self.writetrace('.log', LOG))
+        self.assertEqual(len(samples), 2)
+        self.assertAlmostEqual(samples[0][0], 86398.5)
+        self.assertEqual(samples[0][1], {'CPU': 51.5, 'GPU': 49.0})
+        # The time of day wraps around at midnight, the values are carried over
+        self.assertAlmostEqual(samples[1][0], 86401.5)
+        self.assertEqual(samples[1][1], {'CPU': 52.0, 'GPU': 49.0})
+
+    def test_stats(self):
+        samples = argonreplay.argonreplay_load(self.writetrace('.csv', TRACE))
+        writes = [(0, 0), (5, 30), (15, 30), (25, 55)]
+        stats = argonreplay.argonreplay_stats(samples, writes, [55, 65], 0.5)
+        self.assertEqual(stats["duration"], 30)
+        self.assertEqual(stats["samples"], 4)
+        self.assertEqual(stats["writes"], 4)
+        self.assertEqual(stats["changes"], 2)
+        self.assertEqual(stats["churn"], 55)
+        self.assertAlmostEqual(stats["meanduty"], (30*20 + 55*5) / 30)
+        # Only the sample at 20 s is at or above 55 °C, the one without CPU is skipped
+        self.assertEqual(stats["above"], {55: 10, 65: 0})
+
+    def test_report(self):
+        samples = argonreplay.argonreplay_load(self.writetrace('.csv', TRACE))
+        stats = argonreplay.argonreplay_stats(samples, [(0, 30), (10, 50)], [55], 0.25)
+        report = argonreplay.argonreplay_report(stats).split('\n')
+        self.assertEqual(report[0], 'Trace: 0:00:30, 4 samples')
+        self.assertEqual(report[1], 'I2C writes: 2 (240.0 per hour)')
+        self.assertEqual(report[2], 'Duty cycle churn: 1 changes, 20 % total change (2400.0 % per hour)')
+        self.assertEqual(report[4], 'Time above 55.0 °C: 0:00:10 (33.3 %)')
+        self.assertEqual(report[-1], 'Replay took 0.25 s')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+#
+# Parse tests of the thermal netlink messages, with the command and attribute
+# numbers of linux/thermal.h instead of the constants of argonthermal.py
+#
+import os
+import socket
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source', 'resources', 'lib'))
+
+import argonthermal
+
+# enum thermal_genl_sampling, enum thermal_genl_event, enum thermal_genl_attr
+KERNEL_SAMPLING_TEMP = 0
+KERNEL_EVENT_TZ_CREATE = 1
+KERNEL_EVENT_TZ_TRIP_UP = 5
+KERNEL_EVENT_TZ_TRIP_DOWN = 6
+KERNEL_ATTR_TZ_ID = 2
+KERNEL_ATTR_TZ_TEMP = 3
+KERNEL_ATTR_TZ_TRIP_ID = 5
+FAMILY_ID = 0x1d
+
+
+def kernelattr(attrtype, value, fmt):
+    payload = struct.pack(fmt, value)
+    return struct.pack('=HH', 4 + len(payload), attrtype) + payload
+
+
+def kernelmsg(cmd, attrs):
+    payload = struct.pack('=BBH', cmd, 1, 0) + b''.join(attrs)
+    return struct.pack('=IHHII', 16 + len(payload), FAMILY_ID, 0, 0, 0) + payload
+
+
+class ArgonThermalParseTest(unittest.TestCase):
+    def setUp(self):
+        self.sock, self.injectsock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def tearDown(self):
+        self.sock.close()
+        self.injectsock.close()
+
+    def read(self, *msgs):
+        for msg in msgs:
+            self.injectsock.send(msg)
+        return argonthermal.argonthermal_read((self.sock, FAMILY_ID), 1)
+
+    def test_command_numbers(self):
+        self.assertEqual(argonthermal.THERMAL_GENL_SAMPLING_TEMP, KERNEL_SAMPLING_TEMP)
+        self.assertEqual(argonthermal.THERMAL_GENL_EVENT_TZ_TRIP_UP, KERNEL_EVENT_TZ_TRIP_UP)
+        self.assertEqual(argonthermal.THERMAL_GENL_EVENT_TZ_TRIP_DOWN, KERNEL_EVENT_TZ_TRIP_DOWN)
+
+    def test_sampling_temp(self):
+        events = self.read(kernelmsg(KERNEL_SAMPLING_TEMP, [
+            kernelattr(KERNEL_ATTR_TZ_ID, 0, '=I'),
+            kernelattr(KERNEL_ATTR_TZ_TEMP, 52150, '=i')]))
+        self.assertEqual(events, [{"cmd": argonthermal.THERMAL_GENL_SAMPLING_TEMP, "tz": 0, "temp": 52150, "trip": None}])
+
+    def test_trip_events(self):
+        events = self.read(
+            kernelmsg(KERNEL_EVENT_TZ_TRIP_UP, [
+                kernelattr(KERNEL_ATTR_TZ_ID, 0, '=I'),
+                kernelattr(KERNEL_ATTR_TZ_TRIP_ID, 1, '=I')]),
+            kernelmsg(KERNEL_EVENT_TZ_TRIP_DOWN, [
+                kernelattr(KERNEL_ATTR_TZ_ID, 0, '=I'),
+                kernelattr(KERNEL_ATTR_TZ_TRIP_ID, 1, '=I')]))
+        self.assertEqual([event["cmd"] for event in events], [argonthermal.THERMAL_GENL_EVENT_TZ_TRIP_UP, argonthermal.THERMAL_GENL_EVENT_TZ_TRIP_DOWN])
+        self.assertEqual([event["trip"] for event in events], [1, 1])
+
+    def test_tz_create_is_not_a_sample(self):
+        events = self.read(kernelmsg(KERNEL_EVENT_TZ_CREATE, [kernelattr(KERNEL_ATTR_TZ_ID, 0, '=I')]))
+        self.assertNotEqual(events[0]["cmd"], argonthermal.THERMAL_GENL_SAMPLING_TEMP)
+
+    def test_sendlocal(self):
+        argonthermal.argonthermal_sendlocal(self.injectsock, argonthermal.THERMAL_GENL_SAMPLING_TEMP, 0, 48000)
+        events = argonthermal.argonthermal_read((self.sock, argonthermal.LOCAL_FAMILY_ID), 1)
+        self.assertEqual(events, [{"cmd": KERNEL_SAMPLING_TEMP, "tz": 0, "temp": 48000, "trip": None}])
+
+
+if __name__ == '__main__':
+    unittest.main()